@@ -0,0 +1,78 @@
+"""Measure the import time of the config with ``python -X importtime`` and enforce a budget.
+
+Run from the config directory:
+
+    python bench_import.py --budget-ms 800 --top 20
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+from typing import NamedTuple
+
+
+LINE_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse(stderr: str) -> list[ImportTime]:
+    entries = []
+    for line in stderr.splitlines():
+        if m := LINE_PATTERN.match(line):
+            self_us, cumulative_us, indent, module = m.groups()
+            entries.append(ImportTime(module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def measure(module: str, runs: int) -> list[list[ImportTime]]:
+    cur_dir = Path(__file__).absolute().parent
+    env = os.environ | {"PYTHONPATH": str(cur_dir), "TEST_QTILE_FROM_CLI": "1"}
+    results = []
+    for _ in range(runs):
+        p = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=cur_dir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if p.returncode:
+            print(p.stderr, file=sys.stderr)
+            raise SystemExit(f"importing {module} failed with rc={p.returncode}")
+        results.append(parse(p.stderr))
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="config", help="module to import")
+    parser.add_argument("--budget-ms", type=float, default=1000, help="maximum allowed cumulative import time")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs; the fastest one is reported")
+    parser.add_argument("--top", type=int, default=25, help="number of slowest imports to list")
+    args = parser.parse_args()
+
+    runs = measure(args.module, args.runs)
+    entries = min(runs, key=lambda r: next((e.cumulative_us for e in r if e.module == args.module), 0))
+    total_ms = next(e.cumulative_us for e in entries if e.module == args.module) / 1000
+
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for e in sorted(entries, key=lambda e: e.cumulative_us, reverse=True)[: args.top]:
+        print(f"{e.cumulative_us / 1000:10.1f}ms {e.self_us / 1000:8.1f}ms  {'  ' * e.depth}{e.module}")
+    print(f"\nimport of {args.module!r} took {total_ms:.1f}ms (budget: {args.budget_ms:.0f}ms)")
+    if total_ms > args.budget_ms:
+        print("import time budget exceeded", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Compare qtile's one-by-one Match evaluation with qutely.matching.MatchIndex.
+
+Both are run against synthetic windows whose properties are drawn from the
+floating rules (hits) and random names (misses). Run from the config directory:
+
+    python bench_matching.py --windows 5000 --hit-ratio 0.2
+"""
+import re
+import sys
+import random
+import string
+import argparse
+from time import perf_counter
+from typing import Any, Callable, Optional
+
+from libqtile.config import Match
+
+from qutely.floating_rules import generate_floating_rules, rules
+from qutely.matching import MatchIndex
+
+GROUP_MATCHES = [
+    Match(wm_class="Vivaldi-stable"),
+    Match(wm_class="teams-for-linux"),
+    Match(wm_class="Evolution"),
+    Match(wm_class="Thunderbird"),
+    Match(wm_class="thunderbird"),
+    Match(wm_class="thunderbird-default"),
+    Match(wm_class=re.compile(r".*Firefox.*")),
+    Match(title=re.compile(r".*Firefox.*")),
+]
+TYPES = ["normal", "dialog", "utility", "toolbar", "splash", "notification"]
+
+
+class FakeWindow:
+    def __init__(self, wm_class: Optional[list[str]], name: str, role: Optional[str], wm_type: str) -> None:
+        self.wm_class = wm_class
+        self.name = name
+        self.role = role
+        self.wm_type = wm_type
+
+    def get_wm_class(self) -> Optional[list[str]]:
+        return self.wm_class
+
+    def get_wm_role(self) -> Optional[str]:
+        return self.role
+
+    def get_wm_type(self) -> str:
+        return self.wm_type
+
+    def has_fixed_size(self) -> bool:
+        return False
+
+    def has_fixed_ratio(self) -> bool:
+        return False
+
+
+def random_name(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_letters, k=rng.randint(4, 14)))
+
+
+def make_windows(count: int, hit_ratio: float, seed: int) -> list[FakeWindow]:
+    rng = random.Random(seed)
+    classes = [c for c in rules["wm_class"] if isinstance(c, str)] + ["Polkit-gnome-authentication-agent-1"]
+    windows = []
+    for _ in range(count):
+        if rng.random() < hit_ratio:
+            cls = rng.choice(classes + ["Firefox", "Thunderbird"])
+        else:
+            cls = random_name(rng)
+        role = rng.choice(rules["role"]) if rng.random() < hit_ratio / 4 else rng.choice([None, random_name(rng)])
+        wm_type = rng.choice(TYPES) if rng.random() < hit_ratio else "normal"
+        windows.append(FakeWindow([cls.lower(), cls], random_name(rng), role, wm_type))
+    return windows
+
+
+def time_matcher(compare: Callable[[Any], bool], windows: list[FakeWindow], runs: int) -> tuple[float, list[bool]]:
+    best = float("inf")
+    results: list[bool] = []
+    for _ in range(runs):
+        start = perf_counter()
+        results = [compare(w) for w in windows]
+        best = min(best, perf_counter() - start)
+    return best, results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--windows", type=int, default=5000, help="number of synthetic windows")
+    parser.add_argument("--hit-ratio", type=float, default=0.2, help="share of windows drawn from the rules")
+    parser.add_argument("--runs", type=int, default=5, help="number of runs; the fastest one is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    windows = make_windows(args.windows, args.hit_ratio, args.seed)
+    ok = True
+    print(f"{'rule set':<12}{'rules':>7}{'qtile':>12}{'index':>12}{'speedup':>9}")
+    for name, matches in [("floating", list(generate_floating_rules(rules))), ("groups", GROUP_MATCHES)]:
+        index = MatchIndex(matches)
+        linear, expected = time_matcher(lambda w: any(m.compare(w) for m in matches), windows, args.runs)
+        indexed, actual = time_matcher(index.compare, windows, args.runs)
+        if actual != expected:
+            mismatches = sum(a != e for a, e in zip(actual, expected))
+            print(f"{name}: index disagrees with qtile for {mismatches} windows", file=sys.stderr)
+            ok = False
+        per_window = 1e6 / len(windows)
+        print(
+            f"{name:<12}{len(matches):>7}{linear * per_window:>10.2f}us{indexed * per_window:>10.2f}us"
+            f"{linear / indexed:>8.1f}x"
+        )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Render all templates from fixture variables, time each stage and compare with golden files.
+
+Nothing is queried from the running X server or pywal, so this works outside of
+qtile. Run from the config directory:
+
+    python bench_templates.py --runs 20
+    python bench_templates.py --fixture light --template kitty.conf
+    python bench_templates.py --update-golden
+"""
+import sys
+import difflib
+import argparse
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Any, NamedTuple
+
+from qutely import templates
+from qutely.vars import get_fixture_config
+from qutely.display import FALLBACK_PALETTE
+
+cur_dir = Path(__file__).absolute().parent
+GOLDEN_DIR = cur_dir / "qutely" / "templates" / "golden"
+STAGES = ["parse", "render", "filter", "write"]
+
+LAPTOP = {"width": 1920, "height": 1080}
+
+
+class Fixture(NamedTuple):
+    res: list[dict[str, int]]
+    light_theme: bool
+    only_laptop: bool
+
+
+FIXTURES = {
+    "dark": Fixture([LAPTOP], light_theme=False, only_laptop=True),
+    "light": Fixture([LAPTOP], light_theme=True, only_laptop=True),
+    "multi-screen": Fixture(
+        [LAPTOP, {"width": 2560, "height": 1440}, {"width": 1080, "height": 1920}],
+        light_theme=False,
+        only_laptop=False,
+    ),
+}
+
+
+def render_once(
+    env: Any, spec: templates.TemplateSpec, variables: dict[str, Any], out_dir: Path
+) -> tuple[dict[str, float], str]:
+    src, _ = templates.resolve(spec.src, str(out_dir))
+    source, filename, _ = env.loader.get_source(env, src)
+    times = {}
+
+    start = perf_counter()
+    code = env.compile(source, src, filename)
+    template = env.template_class.from_code(env, code, env.make_globals(None))
+    times["parse"] = perf_counter() - start
+
+    start = perf_counter()
+    chunks = list(template.generate(**variables))
+    times["render"] = perf_counter() - start
+
+    start = perf_counter()
+    output = "".join(templates.filter_output(chunks, templates.line_filter(*spec[2:])))
+    times["filter"] = perf_counter() - start
+
+    start = perf_counter()
+    with templates.AtomicFile(str(out_dir / spec.src)) as f:
+        f.write(output.encode())
+        f.commit()
+    times["write"] = perf_counter() - start
+    return times, output
+
+
+def check_golden(fixture: str, spec: templates.TemplateSpec, output: str, update: bool) -> bool:
+    golden = GOLDEN_DIR / fixture / spec.src
+    if update:
+        golden.parent.mkdir(parents=True, exist_ok=True)
+        golden.write_text(output)
+        return True
+    if not golden.exists():
+        print(f"missing golden file {golden.relative_to(cur_dir)}", file=sys.stderr)
+        return False
+    expected = golden.read_text()
+    if expected == output:
+        return True
+    diff = difflib.unified_diff(
+        expected.splitlines(keepends=True),
+        output.splitlines(keepends=True),
+        fromfile=str(golden.relative_to(cur_dir)),
+        tofile=f"{fixture}/{spec.src} (rendered)",
+    )
+    sys.stderr.writelines(list(diff)[:40])
+    return False
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", action="append", choices=list(FIXTURES), help="fixtures to render (default: all)")
+    parser.add_argument("--template", action="append", help="templates to render (default: all)")
+    parser.add_argument("--runs", type=int, default=10, help="number of runs; the fastest time per stage is reported")
+    parser.add_argument("--update-golden", action="store_true", help="overwrite the golden files with the output")
+    args = parser.parse_args()
+
+    specs = [s for s in templates.ALL_TEMPLATES if not args.template or s.src in args.template]
+    env = templates.make_environment(bytecode_cache=False)
+    ok = True
+    print(f"{'fixture':<14}{'template':<14}" + "".join(f"{stage:>10}" for stage in STAGES) + "  golden")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.fixture or FIXTURES:
+            fixture = FIXTURES[name]
+            wal = None if fixture.light_theme else FALLBACK_PALETTE
+            out_dir = Path(tmp) / name
+            out_dir.mkdir()
+            for spec in specs:
+                variables = get_fixture_config(spec.src, fixture.res, fixture.light_theme, wal, fixture.only_laptop)
+                best = dict.fromkeys(STAGES, float("inf"))
+                for _ in range(args.runs):
+                    times, output = render_once(env, spec, variables, out_dir)
+                    best = {stage: min(best[stage], times[stage]) for stage in STAGES}
+                matches = check_golden(name, spec, output, args.update_golden)
+                ok = ok and matches
+                row = "".join(f"{best[stage] * 1000:8.2f}ms" for stage in STAGES)
+                print(f"{name:<14}{spec.src:<14}{row}  {'ok' if matches else 'DIFFERS'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,17 +2,20 @@ import re
 from pathlib import Path
 from libqtile.config import Screen, Drag, Click, Match, ScratchPad, DropDown
 from libqtile.lazy import lazy
-from libqtile import hook, layout
+from libqtile import layout
 from libqtile.backend.x11.window import Window
 from libqtile.log_utils import logger
 
 # custom imports – parts of config
 from qutely import procs, color, util
 from qutely.procs import Proc
-from qutely.floating_rules import get_floating_rules, floating_dimensions
+from qutely.floating_rules import get_floating_matcher, floating_dimensions
+from qutely.matching import MatchIndex
 from qutely.keys import keys, mod_key
-from qutely.opacity import partial_opacities  # NOQA
+from qutely.opacity import partial_opacities, picom_dimming_enabled  # NOQA
 from qutely.debug import in_debug_mode
+from qutely.profiling import subscribe
+from qutely import window_rules
 from qutely.display import is_light_theme, num_screens
 
 
@@ -108,7 +111,7 @@ matcher = {
     ],
 }
 for g, match in matcher.items():
-    util.group_dict[g].matches.extend(match)
+    util.group_dict[g].matches.append(MatchIndex(match))
 
 for group in util.groups:
     if len(group.name) == 1:
@@ -196,7 +199,7 @@ main = None
 follow_mouse_focus = True
 bring_front_click = False
 cursor_warp = True
-floating_layout = layout.Floating(float_rules=get_floating_rules(), border_width=0)
+floating_layout = layout.Floating(float_rules=[get_floating_matcher()], border_width=0)
 auto_fullscreen = False
 reconfigure_screens = True
 auto_minimize = True
@@ -204,7 +207,7 @@ focus_on_window_activation = "smart"
 wmname = "LG3D"
 
 
-@hook.subscribe.startup_complete
+@subscribe.startup_complete
 async def autostart_once() -> None:
     logger.info("running startup_once")
     ps = [
@@ -213,7 +216,7 @@ async def autostart_once() -> None:
     await Proc.await_many(*ps)
 
 
-@hook.subscribe.startup
+@subscribe.startup
 async def autostart() -> None:
     logger.info("running startup")
     ps = [procs.resume_dunst]
@@ -221,13 +224,13 @@ async def autostart() -> None:
         ps.extend(
             [
                 procs.start_custom_session,
-                util.render_dunstrc(),
-                util.render_kitty_config(),
+                util.render_configs(util.DUNSTRC, util.KITTY_CONF),
                 util.spawn_terminal(),
                 # util.render_terminalrc(),
-                # util.render_picom_config(),
             ]
         )
+        if picom_dimming_enabled():
+            ps.append(util.render_picom_config())
     # if is_light_theme:
     #     ps.append(procs.stop_picom)
     # else:
@@ -242,13 +245,16 @@ async def autostart() -> None:
 #     await util.reload_qtile(qtile)
 
 
-def handle_floating_windows(window: Window) -> None:
+@window_rules.stage("float")
+def handle_floating_windows(window: Window, floating: bool | None = None) -> None:
+    if floating is not None:
+        window.floating = floating
+        return
     if not window or not window.name:
         return
 
     role = window.window.get_wm_window_role()
     name = window.name
-    class_ = window.get_wm_class()[1].lower()
     if name.startswith("chrome-extension://") and name.endswith(
         " is sharing a window."
     ):
@@ -256,14 +262,20 @@ def handle_floating_windows(window: Window) -> None:
     elif role == "InvitationsDialog":
         window.floating = False
 
-    if dim := floating_dimensions.get(class_):
-        window.width, window.height = dim
+
+@window_rules.stage("size")
+def resize_floating_windows(window: Window, size: list[int] | None = None) -> None:
+    if size is None:
+        if not window or not window.name:
+            return
+        size = floating_dimensions.get(window.get_wm_class()[1].lower())
+    if size:
+        window.width, window.height = size
         window.center()
 
 
-@hook.subscribe.client_new
-def handle_floating_for_new_clients(window: Window) -> None:
-    handle_floating_windows(window)
+@window_rules.stage("place")
+def handle_floating_for_new_clients(window: Window, place: str | None = None) -> None:
     from libqtile import qtile
 
     for win in qtile.current_group.windows:
@@ -271,7 +283,7 @@ def handle_floating_for_new_clients(window: Window) -> None:
             win.bring_to_front()
 
 
-@hook.subscribe.client_killed
+@subscribe.client_killed
 def cycle_to_next_client_or_empty_group(window: Window) -> None:
     current_group = window.qtile.current_group
     if len(current_group.windows) > 1 or window not in current_group.windows:
@@ -290,7 +302,7 @@ def cycle_to_next_client_or_empty_group(window: Window) -> None:
     g.toscreen()
 
 
-@hook.subscribe.setgroup
+@subscribe.setgroup
 def move_sticky_windows():
     from libqtile import qtile
 
@@ -301,9 +313,9 @@ def move_sticky_windows():
         window.focus()
 
 
-@hook.subscribe.client_name_updated
-@hook.subscribe.client_managed
-@hook.subscribe.client_focus
+@subscribe.client_name_updated
+@subscribe.client_managed
+@subscribe.client_focus
 def set_group_icon(window: Window | None) -> None:
     if window is None:
         from libqtile import qtile
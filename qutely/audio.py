@@ -0,0 +1,310 @@
+"""Volume and mute of the default sink and source, controlled in-process.
+
+With pulsectl_asyncio installed, one connection to the sound server (PulseAudio
+or pipewire-pulse) is kept open. Key bindings change the volume through it and
+the bar is updated from the server's change events. Without it, the
+configure-volume script is spawned as before.
+"""
+from __future__ import annotations
+
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, NamedTuple, Optional
+
+from libqtile.log_utils import logger
+from qutely.profiling import subscribe
+
+VOLUME_STEP = 0.05
+MAX_VOLUME = 1.0
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+
+class AudioState(NamedTuple):
+    volume: float
+    muted: bool
+    mic_volume: float
+    mic_muted: bool
+
+
+Listener = Callable[[AudioState], None]
+
+
+def has_pulse() -> bool:
+    try:
+        import pulsectl_asyncio  # NOQA
+    except ImportError:
+        return False
+    return True
+
+
+def _clamp(volume: float) -> float:
+    return round(min(max(volume, 0.0), MAX_VOLUME), 4)
+
+
+class Backend(ABC):
+    # whether the backend reports the state and its changes
+    has_state = True
+
+    async def connect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def state(self) -> Optional[AudioState]:
+        ...
+
+    @abstractmethod
+    async def change_volume(self, delta: float, mic: bool = False) -> None:
+        ...
+
+    @abstractmethod
+    async def set_mute(self, muted: Optional[bool], mic: bool = False) -> None:
+        """Mute or unmute, toggle if ``muted`` is None."""
+
+    @abstractmethod
+    def events(self) -> AsyncIterator[None]:
+        """Yield whenever the server reports a change of a sink, source or default."""
+
+
+class PulseBackend(Backend):
+    def __init__(self, client_name: str = "qtile") -> None:
+        self.client_name = client_name
+        self.pulse: Any = None
+
+    async def connect(self) -> None:
+        import pulsectl_asyncio
+
+        await self.close()
+        self.pulse = pulsectl_asyncio.PulseAsync(self.client_name)
+        await self.pulse.connect()
+
+    async def close(self) -> None:
+        if self.pulse is not None:
+            self.pulse.close()
+            self.pulse = None
+
+    async def _device(self, mic: bool) -> Any:
+        info = await self.pulse.server_info()
+        if mic:
+            return await self.pulse.get_source_by_name(info.default_source_name)
+        return await self.pulse.get_sink_by_name(info.default_sink_name)
+
+    async def state(self) -> AudioState:
+        sink = await self._device(mic=False)
+        source = await self._device(mic=True)
+        return AudioState(
+            sink.volume.value_flat, bool(sink.mute), source.volume.value_flat, bool(source.mute)
+        )
+
+    async def change_volume(self, delta: float, mic: bool = False) -> None:
+        device = await self._device(mic)
+        await self.pulse.volume_set_all_chans(device, _clamp(device.volume.value_flat + delta))
+
+    async def set_mute(self, muted: Optional[bool], mic: bool = False) -> None:
+        device = await self._device(mic)
+        await self.pulse.mute(device, not device.mute if muted is None else muted)
+
+    async def events(self) -> AsyncIterator[None]:
+        async for _ in self.pulse.subscribe_events("sink", "source", "server"):
+            yield None
+
+
+class ScriptBackend(Backend):
+    """Fallback without a connection to the sound server."""
+
+    has_state = False
+
+    def __init__(self, script: str = "configure-volume") -> None:
+        self.script = script
+        # by argument, key repeat would otherwise start one process per press
+        self.coalescers: dict[str, Any] = {}
+
+    async def _run(self, arg: str) -> None:
+        from qutely.procs import Proc
+
+        await Proc(self.script, arg).run()
+
+    async def _run_coalesced(self, arg: str) -> None:
+        from qutely.keys import Coalesce, Coalescer
+
+        if (coalescer := self.coalescers.get(arg)) is None:
+            coalescer = self.coalescers[arg] = Coalescer(Coalesce(f"{self.script} {arg}"))
+        await coalescer.press(None)
+
+    async def state(self) -> None:
+        return None
+
+    async def change_volume(self, delta: float, mic: bool = False) -> None:
+        direction = "--up" if delta > 0 else "--down"
+        await self._run_coalesced(f"{direction}-mic" if mic else direction)
+
+    async def set_mute(self, muted: Optional[bool], mic: bool = False) -> None:
+        if muted is None:
+            await self._run("--toggle-mic" if mic else "--toggle")
+        elif muted:
+            await self._run("--mute-all")
+        else:
+            logger.warning(f"{self.script} cannot unmute, only toggle")
+
+    async def events(self) -> AsyncIterator[None]:
+        await asyncio.Event().wait()
+        yield None
+
+
+class FakeBackend(Backend):
+    """In-memory sound server for tests. Changes are reported as events."""
+
+    def __init__(self, state: AudioState = AudioState(0.5, False, 0.5, False)) -> None:
+        self._state = state
+        self.changes: asyncio.Queue[None] = asyncio.Queue()
+        self.connected = False
+
+    async def connect(self) -> None:
+        self.connected = True
+
+    async def close(self) -> None:
+        self.connected = False
+
+    async def state(self) -> AudioState:
+        return self._state
+
+    def set_state(self, **changes: Any) -> None:
+        """Change the state as another client would do."""
+        self._state = self._state._replace(**changes)
+        self.changes.put_nowait(None)
+
+    async def change_volume(self, delta: float, mic: bool = False) -> None:
+        key = "mic_volume" if mic else "volume"
+        self.set_state(**{key: _clamp(getattr(self._state, key) + delta)})
+
+    async def set_mute(self, muted: Optional[bool], mic: bool = False) -> None:
+        key = "mic_muted" if mic else "muted"
+        self.set_state(**{key: not getattr(self._state, key) if muted is None else muted})
+
+    async def events(self) -> AsyncIterator[None]:
+        while True:
+            await self.changes.get()
+            yield None
+
+
+def get_backend() -> Backend:
+    return PulseBackend() if has_pulse() else ScriptBackend()
+
+
+class AudioController:
+    def __init__(self, backend: Optional[Backend] = None, step: float = VOLUME_STEP) -> None:
+        self.backend = backend or get_backend()
+        self.step = step
+        self.state: Optional[AudioState] = None
+        self.listeners: list[Listener] = []
+        self.watcher: Optional[asyncio.Task[None]] = None
+        self._started: Optional[asyncio.Future[None]] = None
+
+    def subscribe(self, listener: Listener) -> None:
+        self.listeners.append(listener)
+        if self.state is not None:
+            listener(self.state)
+
+    def unsubscribe(self, listener: Listener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    async def start(self) -> None:
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        await self._started
+
+    async def _start(self) -> None:
+        try:
+            await self.backend.connect()
+            await self.refresh()
+        except Exception as e:
+            # the watcher keeps trying to reconnect
+            logger.warning(f"cannot connect to the sound server: {e}")
+        if self.backend.has_state:
+            self.watcher = asyncio.create_task(self.watch())
+
+    async def stop(self) -> None:
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+        self._started = None
+        await self.backend.close()
+
+    async def refresh(self) -> None:
+        state = await self.backend.state()
+        if state is None or state == self.state:
+            return
+        self.state = state
+        for listener in self.listeners:
+            try:
+                listener(state)
+            except Exception as e:
+                logger.error(f"audio listener {listener} failed: {e}", exc_info=True)
+
+    async def watch(self) -> None:
+        attempt = 0
+        while True:
+            try:
+                async for _ in self.backend.events():
+                    attempt = 0
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"lost connection to the sound server: {e}")
+            delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+            attempt += 1
+            await asyncio.sleep(delay)
+            try:
+                await self.backend.connect()
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"cannot reconnect to the sound server: {e}")
+
+    async def _apply(self, change: Callable[[], Any]) -> None:
+        await self.start()
+        try:
+            await change()
+        except Exception as e:
+            logger.error(f"cannot change the volume: {e}", exc_info=True)
+            return
+        # do not wait for the server's event to update the bar
+        await self.refresh()
+
+    async def volume_up(self, *_: Any) -> None:
+        await self._apply(lambda: self.backend.change_volume(self.step))
+
+    async def volume_down(self, *_: Any) -> None:
+        await self._apply(lambda: self.backend.change_volume(-self.step))
+
+    async def toggle_mute(self, *_: Any) -> None:
+        await self._apply(lambda: self.backend.set_mute(None))
+
+    async def mic_up(self, *_: Any) -> None:
+        await self._apply(lambda: self.backend.change_volume(self.step, mic=True))
+
+    async def mic_down(self, *_: Any) -> None:
+        await self._apply(lambda: self.backend.change_volume(-self.step, mic=True))
+
+    async def toggle_mic(self, *_: Any) -> None:
+        await self._apply(lambda: self.backend.set_mute(None, mic=True))
+
+    async def mute_all(self, *_: Any) -> None:
+        async def mute() -> None:
+            await self.backend.set_mute(True)
+            if self.backend.has_state:
+                await self.backend.set_mute(True, mic=True)
+
+        await self._apply(mute)
+
+
+# config reloads re-execute this module, the connection and its watcher are kept
+controller: AudioController = globals().get("controller") or AudioController()
+
+
+@subscribe.startup_complete
+async def start_audio() -> None:
+    await controller.start()
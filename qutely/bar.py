@@ -3,35 +3,30 @@ from __future__ import annotations
 import os
 import re
 import math
-import psutil
-import sqlite3
 import subprocess
 from enum import Enum
 from typing import Optional, Any, TYPE_CHECKING, Callable
 from libqtile import bar
 from libqtile.command.base import expose_command
 from libqtile.utils import add_signal_receiver
-from dbus_fast import Message, MessageType, BusType, Variant
-from dbus_fast.aio import MessageBus
 
 if TYPE_CHECKING:
+    from dbus_fast.aio import MessageBus
     from libqtile import widget
 else:
     from qtile_extras import widget
-from qtile_extras.widget.decorations import BorderDecoration
 from libqtile.widget.base import Mirror, ThreadPoolText
 from libqtile.widget.generic_poll_text import GenPollText as _GenPollText
 from libqtile.scratchpad import ScratchPad
 from libqtile.log_utils import logger
-from qutely.widgets.capslocker import CapsLockIndicator
-
-from qutely.widgets.checkclock_widget import CheckclockWidget
 from qutely.widgets.check_and_warn import CheckAndWarnWidget, CheckState
+from qutely.widgets.keyboard_layout import KeyboardLayout
 
 # from widgets.contextmenu import ContextMenu, SpawnedMenu
 import datetime
-from qutely import util, color, procs
-from qutely.display import sync_get_xrandr_output
+from qutely import audio, util, color, procs
+from qutely.debug import profile_hooks, profile_keys
+from qutely.display import get_screens
 from pathlib import Path
 
 BAR_HEIGHT = 26
@@ -106,6 +101,8 @@ class Notifier:
         }
 
     async def send(self, title: str, msg: str, img: Path | None = None, urgency: Urgency = Urgency.NORMAL) -> None:
+        from dbus_fast import Message, MessageType, Variant
+
         img_path = img or self.default_img
         img_string = str(img_path) if img_path else ""
         msg = Message(
@@ -131,6 +128,9 @@ class Notifier:
 
     @classmethod
     async def of(cls, id: int, app: str, session: bool = True, default_img: Path | None = None, low_timeout: int = 1000, normal_timeout: int = 3000, critical_timeout: int = -1) -> Notifier:
+        from dbus_fast import BusType
+        from dbus_fast.aio import MessageBus
+
         t = BusType.SESSION if session else BusType.SYSTEM
         bus = await MessageBus(bus_type=t).connect()
         return cls(bus, id, app, default_img, low_timeout, normal_timeout, critical_timeout)
@@ -228,7 +228,7 @@ class ArrowGraph(_GenPollText):
     def __init__(self, **config):
         super().__init__(**config)
         self.add_defaults(ArrowGraph.defaults)
-        self.colors = tuple(color.hex_to_dec(c) for c in self.colors)
+        self.gradient = color.Gradient(self.colors, self.max)
         self.up = 0
         self.down = 0
         if self.use_diff:
@@ -246,12 +246,8 @@ class ArrowGraph(_GenPollText):
         else:
             up_value = up
             down_value = down
-        up_color = color.gradient(
-            value=up_value, max_value=self.max, colors=self.colors
-        )
-        down_color = color.gradient(
-            value=down_value, max_value=self.max, colors=self.colors
-        )
+        up_color = self.gradient(up_value)
+        down_color = self.gradient(down_value)
         if self.up_first:
             arrows = self.span("🠩", up_color), self.span("🠫", down_color)
         else:
@@ -277,7 +273,7 @@ class DotGraph(_GenPollText):
         self.add_defaults(DotGraph.defaults)
         self.graph_length *= 2
         self.values = (0,) * self.graph_length
-        self.colors = tuple(color.hex_to_dec(c) for c in self.colors)
+        self.gradient = color.Gradient(self.colors, self.max, scaling=1.2)
 
     def single_dot(self, prev, cur):
         p = self.normalize(prev)
@@ -293,9 +289,7 @@ class DotGraph(_GenPollText):
             for i in range(0, self.graph_length - 1, 2)
         )
         avg = sum(values) / len(values)
-        c = color.gradient(
-            value=avg, max_value=self.max, colors=self.colors, scaling=1.2
-        )
+        c = self.gradient(avg)
         return f"<tt><span foreground='#{c}'>{dots}</span></tt>"
 
     def poll(self):
@@ -308,17 +302,16 @@ def space():
     return widget.Spacer(length=14, background=background)
 
 
+num_procs_gradient = color.Gradient(
+    (color.BRIGHT_GREEN, color.BRIGHT_ORANGE, color.BRIGHT_RED), max_value=200
+)
+
+
 def get_num_procs():
+    import psutil
+
     number = sum(1 for _ in psutil.process_iter())
-    c = color.gradient(
-        value=number - 250,
-        max_value=200,
-        colors=(
-            color.hex_to_dec(color.BRIGHT_GREEN),
-            color.hex_to_dec(color.BRIGHT_ORANGE),
-            color.hex_to_dec(color.BRIGHT_RED),
-        ),
-    )
+    c = num_procs_gradient(number - 250)
     return f"<span foreground='#{c}'>{number}</span>"
 
 
@@ -388,6 +381,8 @@ def get_tailscale_state() -> str:
 
 
 def get_net_throughput():
+    import psutil
+
     net = psutil.net_io_counters(pernic=True)
     up = sum(net_dev.bytes_sent for dev in IFACES if (net_dev := net.get(dev, 0)))
     down = sum(net_dev.bytes_recv for dev in IFACES if (net_dev := net.get(dev, 0)))
@@ -486,10 +481,14 @@ db_key = "QTILE_CHECKCLOCK_DB"
 if db_key in os.environ:
     checkclock_args["db_path"] = os.environ[db_key]
 
+# from qutely.widgets.checkclock_widget import CheckclockWidget
 # checkclock_widget = CheckclockWidget(**checkclock_args)
 
 
 def get_bar(screen_idx: int):
+    import psutil
+    from qtile_extras.widget.decorations import BorderDecoration
+
     is_primary = screen_idx == 0
     widgets = []
 
@@ -508,7 +507,7 @@ def get_bar(screen_idx: int):
         "fontsize": 20,
         "markup": True,
     }
-    if sync_get_xrandr_output().num_screens > 1:
+    if get_screens().num_screens > 1:
         if is_primary:
             group_box = GroupBox(
                 name="groupbox-0",
@@ -535,7 +534,7 @@ def get_bar(screen_idx: int):
         )
     widgets.append(group_box)
 
-    if sync_get_xrandr_output().num_screens > 1:
+    if get_screens().num_screens > 1:
         current_screen = widget.CurrentScreen(
             active_text="✔",
             inactive_text="",
@@ -577,9 +576,13 @@ def get_bar(screen_idx: int):
         },
         foreground=color.MID_GRAY,
     )
-    kbd = widget.KeyboardLayout(**kdb_settings)
+    kbd = KeyboardLayout(**kdb_settings)
 
     if is_primary:
+        if profile_hooks or profile_keys:
+            from qutely.widgets.profiler import ProfilerWidget
+
+            widgets.append(ProfilerWidget(name="profiler", **(settings | dict(foreground=color.BRIGHT_RED))))
         widgets.append(borg_widget)
         # widgets.append(checkclock_widget)
         widgets.append(space())
@@ -648,9 +651,16 @@ def get_bar(screen_idx: int):
         volume_app="pavucontrol",
         foreground=color.MID_GRAY,
     )
-    volume = widget.Volume(**volume_settings)
+    if audio.has_pulse():
+        from qutely.widgets.volume import VolumeWidget
+
+        volume = VolumeWidget(**settings | dict(fontsize=18, font="Ubuntu", foreground=color.MID_GRAY))
+    else:
+        volume = widget.Volume(**volume_settings)
     widgets.append(volume)
 
+    from qutely.widgets.capslocker import CapsLockIndicator
+
     caps_lock = CapsLockIndicator(send_notifications=is_primary, **settings)
     widgets.append(caps_lock)
 
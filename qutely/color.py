@@ -81,6 +81,39 @@ def gradient(value, max_value, colors, scaling=None):
     return tuple(lin(start[i], stop[i], scaling_factor) for i in range(3))
 
 
+class Gradient:
+    """``gradient`` precomputed for ``size`` evenly spaced values from 0 to ``max_value``.
+
+    Looking up a value is a clamp and an index into the table of hex strings.
+    """
+
+    def __init__(self, colors, max_value, scaling=None, size=256):
+        colors = tuple(hex_to_dec(c) if isinstance(c, str) else tuple(c) for c in colors)
+        self.max_value = max_value
+        self.size = size
+        self.scale = (size - 1) / max_value
+        self.lut = [
+            gradient(max_value * i / (size - 1), max_value, colors, scaling) for i in range(size)
+        ]
+
+    def index(self, value):
+        i = int(value * self.scale + 0.5)
+        return 0 if i < 0 else self.size - 1 if i >= self.size else i
+
+    def __call__(self, value):
+        return self.lut[self.index(value)]
+
+    def map(self, values):
+        """Return the colors of all ``values``, vectorized if numpy is available."""
+        try:
+            import numpy as np
+        except ImportError:
+            return [self(v) for v in values]
+        indices = np.clip(np.floor(np.asarray(values, dtype=float) * self.scale + 0.5), 0, self.size - 1)
+        lut = self.lut
+        return [lut[i] for i in indices.astype(int).tolist()]
+
+
 @functools.lru_cache(maxsize=1)
 def get_ascii_colors():
     CUR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -2,3 +2,5 @@ import os
 
 
 in_debug_mode = os.environ.get("QTILE_DEBUG_MODE", "off") == "on"
+profile_hooks = os.environ.get("QTILE_PROFILE_HOOKS", "off") == "on"
+profile_keys = os.environ.get("QTILE_PROFILE_KEYS", "off") == "on"
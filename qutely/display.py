@@ -3,14 +3,21 @@ from __future__ import annotations
 import os
 import sys
 import json
-import yaml
-import pywal
+import asyncio
+import hashlib
 from pathlib import Path
 from typing import TypedDict, Any, NamedTuple
 from asyncio.subprocess import create_subprocess_exec as new_proc, PIPE
+from libqtile.log_utils import logger
+from qutely.profiling import subscribe
 
 
 THEME_BG_KEY = "QTILE_LIGHT_THEME"
+# set to "jc" to parse the output of xrandr instead of querying randr via xcffib
+XRANDR_BACKEND_KEY = "QTILE_XRANDR_BACKEND"
+SCREEN_PROFILES_FILE = Path("~/.config/qtile/screen-profiles.json").expanduser()
+PALETTE_CACHE_DIR = Path("~/.cache/qtile/palettes").expanduser()
+WALLPAPER = Path("~/.wallpaper").expanduser()
 
 
 class ScreensDict(TypedDict):
@@ -49,6 +56,16 @@ class PhysicalScreen(NamedTuple):
     mm_height: int
 
 
+class OutputLayout(NamedTuple):
+    width: int
+    height: int
+    x: int
+    y: int
+    rotation: str = "normal"
+    primary: bool = False
+    rate: float = 0.0
+
+
 def _parse_device(dev: dict[str, Any]) -> PhysicalScreen:
     return PhysicalScreen(
         name=dev["device_name"],
@@ -66,9 +83,15 @@ def _parse_device(dev: dict[str, Any]) -> PhysicalScreen:
     )
 
 
-def parse_xrandr(input: str) -> VirtualScreen:
-    v_screen = json.loads(input)["screens"][0]
-    screens = [_parse_device(d) for d in v_screen["devices"]]
+def make_virtual_screen(
+    screens: list[PhysicalScreen],
+    width: int,
+    height: int,
+    min_width: int,
+    max_width: int,
+    min_height: int,
+    max_height: int,
+) -> VirtualScreen:
     connected = [s for s in screens if s.is_connected]
     disconnected = [s for s in screens if not s.is_connected]
     in_use = [s for s in connected if s.is_used]
@@ -80,12 +103,12 @@ def parse_xrandr(input: str) -> VirtualScreen:
     all_used = set(connected) == set(in_use)
 
     return VirtualScreen(
-        min_width=v_screen["minimum_width"],
-        max_width=v_screen["maximum_width"],
-        width=v_screen["current_width"],
-        min_height=v_screen["minimum_height"],
-        max_height=v_screen["maximum_height"],
-        height=v_screen["current_height"],
+        min_width=min_width,
+        max_width=max_width,
+        width=width,
+        min_height=min_height,
+        max_height=max_height,
+        height=height,
         connected=connected,
         disconnected=disconnected,
         primary=primary,
@@ -96,7 +119,47 @@ def parse_xrandr(input: str) -> VirtualScreen:
     )
 
 
+def parse_xrandr(input: str) -> VirtualScreen:
+    v_screen = json.loads(input)["screens"][0]
+    return make_virtual_screen(
+        [_parse_device(d) for d in v_screen["devices"]],
+        min_width=v_screen["minimum_width"],
+        max_width=v_screen["maximum_width"],
+        width=v_screen["current_width"],
+        min_height=v_screen["minimum_height"],
+        max_height=v_screen["maximum_height"],
+        height=v_screen["current_height"],
+    )
+
+
+def _use_native_randr() -> bool:
+    if os.environ.get(XRANDR_BACKEND_KEY, "randr") == "jc":
+        return False
+    try:
+        import xcffib.randr  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
 def sync_get_xrandr_output() -> VirtualScreen:
+    if _use_native_randr():
+        from qutely import randr
+
+        try:
+            return randr.query_screens()
+        except Exception as e:
+            logger.warning(f"could not query randr natively, falling back to jc: {e}")
+    return sync_get_jc_output()
+
+
+async def get_xrandr_output() -> VirtualScreen:
+    if _use_native_randr():
+        return sync_get_xrandr_output()
+    return await get_jc_output()
+
+
+def sync_get_jc_output() -> VirtualScreen:
     from subprocess import Popen as new_proc, PIPE
 
     proc = new_proc(args=["xrandr"], stdout=PIPE, stderr=PIPE, text=True)
@@ -108,7 +171,7 @@ def sync_get_xrandr_output() -> VirtualScreen:
     return parse_xrandr(stdout)
 
 
-async def get_xrandr_output() -> VirtualScreen:
+async def get_jc_output() -> VirtualScreen:
     proc = await new_proc("xrandr", stdout=PIPE, stderr=PIPE)
     stdout, stderr = await proc.communicate()
     jc = await new_proc("jc", "--xrandr", stdin=PIPE, stdout=PIPE, stderr=PIPE)
@@ -116,19 +179,251 @@ async def get_xrandr_output() -> VirtualScreen:
     return parse_xrandr(stdout.decode())
 
 
+class ScreenProfiles:
+    """Monitor layouts keyed by the fingerprint of the connected outputs.
+
+    A fingerprint is made up of the connector names and edid hashes, so docking at a
+    known desk restores its layout through randr on hotplug. Named profiles (laptop,
+    home, …) are learned from the configure-screens script the first time they are
+    used and are applied in-process afterwards.
+    """
+
+    hotplug_delay = 0.5
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.profiles: dict[str, dict[str, OutputLayout]] = {}
+        self.fingerprints: dict[str, dict[str, OutputLayout]] = {}
+        self.applied = (0, 0)
+        self.last_fingerprint: str | None = None
+        self._hotplug: Any = None
+        self.load()
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        with self.path.open("r") as f:
+            data = json.load(f)
+        for key in ("profiles", "fingerprints"):
+            getattr(self, key).update(
+                {
+                    name: {output: OutputLayout(**out) for output, out in layout.items()}
+                    for name, layout in data.get(key, {}).items()
+                }
+            )
+
+    def save(self) -> None:
+        data = {
+            key: {
+                name: {output: out._asdict() for output, out in layout.items()}
+                for name, layout in getattr(self, key).items()
+            }
+            for key in ("profiles", "fingerprints")
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_suffix(".tmp")
+        with tmp_file.open("w") as f:
+            json.dump(data, f, indent=2)
+        tmp_file.replace(self.path)
+
+    @staticmethod
+    def fingerprint() -> str:
+        from qutely import randr
+
+        _, outputs = randr.query_outputs()
+        connected = sorted(f"{o.name}:{o.edid_hash}" for o in outputs.values() if o.connected)
+        return hashlib.sha1("\n".join(connected).encode()).hexdigest()
+
+    @staticmethod
+    def layout_of(v_screen: VirtualScreen) -> dict[str, OutputLayout]:
+        return {
+            s.name: OutputLayout(
+                width=s.width,
+                height=s.height,
+                x=s.xoffset,
+                y=s.yoffset,
+                rotation=s.rotation,
+                primary=s.is_primary,
+            )
+            for s in v_screen.in_use
+        }
+
+    def caused(self, event: Any) -> bool:
+        if event is None or not self.applied[0]:
+            return False
+        from qutely import randr
+
+        timestamp, config_timestamp = randr.event_timestamps(event)
+        return timestamp <= self.applied[0] and config_timestamp <= self.applied[1]
+
+    def learn(self, name: str | None = None) -> None:
+        layout = self.layout_of(sync_get_xrandr_output())
+        fingerprint = self.fingerprint()
+        self.fingerprints[fingerprint] = layout
+        self.last_fingerprint = fingerprint
+        if name:
+            self.profiles[name] = layout
+        self.save()
+
+    def apply(self, layout: dict[str, OutputLayout]) -> None:
+        from qutely import randr
+
+        old = get_screens()
+        self.applied = randr.apply_layout(layout)
+        # the new topology is known, so prime the cache instead of querying it again
+        screens = []
+        for s in old.by_name.values():
+            if out := layout.get(s.name):
+                s = s._replace(
+                    width=out.width,
+                    height=out.height,
+                    xoffset=out.x,
+                    yoffset=out.y,
+                    rotation=out.rotation,
+                    reflection="normal",
+                    is_primary=out.primary,
+                    is_used=True,
+                )
+            else:
+                s = s._replace(width=0, height=0, xoffset=0, yoffset=0, is_primary=False, is_used=False)
+            screens.append(s)
+        set_screens(
+            make_virtual_screen(
+                screens,
+                width=max(out.x + out.width for out in layout.values()),
+                height=max(out.y + out.height for out in layout.values()),
+                min_width=old.min_width,
+                max_width=old.max_width,
+                min_height=old.min_height,
+                max_height=old.max_height,
+            )
+        )
+
+    async def apply_profile(self, name: str) -> None:
+        layout = self.profiles.get(name)
+        if layout is not None and _use_native_randr():
+            try:
+                self.apply(layout)
+                self.fingerprints[self.fingerprint()] = layout
+                self.save()
+                return
+            except Exception as e:
+                logger.warning(f"cannot apply screen profile {name!r} via randr: {e}")
+        from qutely import procs
+
+        await procs.Proc("configure-screens", name).run()
+        if _use_native_randr():
+            self.learn(name)
+
+    def schedule_hotplug(self) -> None:
+        import asyncio
+
+        if self._hotplug is not None:
+            self._hotplug.cancel()
+        # hotplugging emits a burst of events, only act once it has settled
+        self._hotplug = asyncio.get_running_loop().call_later(self.hotplug_delay, self.on_hotplug)
+
+    def on_hotplug(self) -> None:
+        self._hotplug = None
+        fingerprint = self.fingerprint()
+        if fingerprint == self.last_fingerprint:
+            return
+        self.last_fingerprint = fingerprint
+        if (layout := self.fingerprints.get(fingerprint)) is None:
+            return
+        if layout == self.layout_of(get_screens()):
+            return
+        logger.info(f"applying stored screen layout for outputs {list(layout)}")
+        try:
+            self.apply(layout)
+        except Exception as e:
+            logger.error(f"cannot apply stored screen layout: {e}", exc_info=True)
+
+
+screen_profiles: ScreenProfiles = globals().get("screen_profiles") or ScreenProfiles(
+    SCREEN_PROFILES_FILE
+)
+
+
+async def apply_screen_profile(qtile: Any, name: str) -> None:
+    await screen_profiles.apply_profile(name)
+
+
+# the cache lives as long as the process: config reloads re-execute this module,
+# so existing values are picked up from the module dict instead of being reset
+_screen_cache: VirtualScreen | None = globals().get("_screen_cache")
+_screen_generation: int = globals().get("_screen_generation", 0)
+_screen_watcher: Any = globals().get("_screen_watcher")
+
+
+def get_screens() -> VirtualScreen:
+    global _screen_cache
+    if _screen_cache is None:
+        _screen_cache = sync_get_xrandr_output()
+    return _screen_cache
+
+
+def screen_generation() -> int:
+    return _screen_generation
+
+
+def set_screens(v_screen: VirtualScreen) -> None:
+    global _screen_cache, _screen_generation
+    _screen_cache = v_screen
+    _screen_generation += 1
+
+
+def invalidate_screens(event: Any = None) -> None:
+    global _screen_cache, _screen_generation
+    if _screen_cache is None or screen_profiles.caused(event):
+        return
+    _screen_cache = None
+    _screen_generation += 1
+    logger.debug(f"screen layout changed, generation is now {_screen_generation}")
+
+
+def get_resolutions() -> list[dict[str, int]]:
+    return [{"width": s.width, "height": s.height} for s in get_screens().in_use]
+
+
+@subscribe.startup
+def start_screen_watcher() -> None:
+    global _screen_watcher
+    if _screen_watcher is not None or not _use_native_randr():
+        return
+    from qutely import randr
+
+    try:
+        _screen_watcher = randr.watch_screen_changes(on_randr_event)
+    except Exception as e:
+        logger.warning(f"cannot watch randr events, relying on qtile's screen_change: {e}")
+
+
+def on_randr_event(event: Any) -> None:
+    from qutely import randr
+
+    invalidate_screens(event)
+    if randr.is_output_change(event) and not screen_profiles.caused(event):
+        screen_profiles.schedule_hotplug()
+
+
+# qtile's own ScreenChangeNotify handling fires before screens_reconfigured, which
+# may arrive earlier than the event on the watcher connection
+subscribe.screen_change(invalidate_screens)
+
+
 def is_laptop(name: str) -> bool:
-    v_screen = sync_get_xrandr_output()
-    return name in v_screen.by_name
+    return name in get_screens().by_name
 
 
 def is_only_laptop(name: str) -> bool:
-    v_screen = sync_get_xrandr_output()
+    v_screen = get_screens()
     return len(v_screen.in_use) == 1 and v_screen.in_use[0].name == name
 
 
 if "config" in sys.modules.keys() or os.environ.get("TEST_QTILE_FROM_CLI"):
-    screen = sync_get_xrandr_output()
-    res = [{"width": s.width, "height": s.height} for s in screen.in_use]
+    screen = get_screens()
+    res = get_resolutions()
     num_screens = len(screen.in_use)
 
 
@@ -140,20 +435,150 @@ else:
     light_theme_marker_file.unlink(missing_ok=True)
 
 
-def get_wal_colors() -> dict[str, Any]:
-    yaml_file = os.path.join(pywal.colors.CACHE_DIR, "colors.yml")
-    if not os.path.exists(yaml_file):
-        wallpaper = os.path.expanduser("~/.wallpaper")
-        colors = pywal.colors.get(wallpaper)
-        pywal.export.every(colors)
-    else:
-        with open(yaml_file, "r") as f:
-            colors = yaml.load(f.read(), Loader=yaml.BaseLoader)
+FALLBACK_PALETTE: dict[str, Any] = {
+    "colors": [
+        "#0d0d00",
+        "#cd3000",
+        "#70a000",
+        "#c0c000",
+        "#4070a0",
+        "#a04080",
+        "#40a0a0",
+        "#d0d0d0",
+        "#484848",
+        "#ff4000",
+        "#90d000",
+        "#ffff00",
+        "#60a0e0",
+        "#e060c0",
+        "#60e0e0",
+        "#ffffff",
+    ],
+    "bg": "#0d0d00",
+    "fg": "#d0d0d0",
+    "cursor": "#c0c000",
+}
+
+_palettes: dict[str, dict[str, Any]] = globals().get("_palettes", {})
+_wallpaper_hashes: dict[tuple[str, int, int], str] = globals().get("_wallpaper_hashes", {})
+# running jobs are kept over a reload, so a reload does not start a second one
+_palette_jobs: dict[str, Any] = globals().get("_palette_jobs", {})
+
+
+def wallpaper_hash(path: Path) -> str:
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    if (digest := _wallpaper_hashes.get(key)) is None:
+        h = hashlib.blake2b(digest_size=16)
+        with path.open("rb") as f:
+            while chunk := f.read(1 << 16):
+                h.update(chunk)
+        digest = _wallpaper_hashes[key] = h.hexdigest()
+    return digest
+
+
+def to_palette(colors: dict[str, Any]) -> dict[str, Any]:
     # all_colors = ["#" + complement(c, 0.4) if 1 < i < 9 else c for i, c in enumerate(colors["colors"].values())]
-    all_colors = colors["colors"].values()
     return {
-        "colors": all_colors,
+        "colors": list(colors["colors"].values()),
         "bg": colors["special"]["background"],
         "fg": colors["special"]["foreground"],
         "cursor": colors["special"]["cursor"],
     }
+
+
+def _write_palette(palette: dict[str, Any], dest: Path) -> None:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = dest.with_suffix(".tmp")
+    with tmp_file.open("w") as f:
+        json.dump(palette, f, separators=(",", ":"))
+    tmp_file.replace(dest)
+
+
+def compute_palette(wallpaper: str, dest: str) -> None:
+    import pywal
+
+    colors = pywal.colors.get(wallpaper)
+    pywal.export.every(colors)
+    _write_palette(to_palette(colors), Path(dest))
+
+
+def _palette_from_wal_cache(wallpaper: Path) -> dict[str, Any] | None:
+    # pywal's own cache is valid if it has been generated from the current wallpaper
+    wal_file = Path("~/.cache/wal/colors.json").expanduser()
+    try:
+        with wal_file.open("r") as f:
+            colors = json.load(f)
+        if Path(colors["wallpaper"]).expanduser().resolve() != wallpaper.resolve():
+            return None
+        return to_palette(colors)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+async def _render_palette_templates() -> None:
+    from qutely import procs
+    from qutely.util import DUNSTRC, KITTY_CONF, render_configs
+
+    await render_configs(DUNSTRC, KITTY_CONF)
+    await procs.resume_dunst.clone().run()
+
+
+def _on_palette_job_done(job: Any, wallpaper: Path) -> None:
+    if job.exitcode:
+        logger.error(f"computing the color palette of {wallpaper} failed with exit code {job.exitcode}")
+        return
+    # the templates rendered meanwhile used the fallback palette
+    logger.info(f"color palette of {wallpaper} computed, rendering the templates again")
+    asyncio.create_task(_render_palette_templates())
+
+
+def _watch_palette_job(job: Any, wallpaper: Path) -> None:
+    from libqtile import qtile
+
+    job.join()
+    if qtile is not None:
+        qtile.call_soon_threadsafe(_on_palette_job_done, job, wallpaper)
+
+
+def _start_palette_job(wallpaper: Path, dest: Path) -> None:
+    import threading
+    import multiprocessing
+
+    key = dest.stem
+    if (job := _palette_jobs.get(key)) is not None and job.is_alive():
+        return
+    # spawn instead of fork: forking the running window manager would duplicate its
+    # threads and x connection
+    job = multiprocessing.get_context("spawn").Process(
+        target=compute_palette, args=(str(wallpaper), str(dest)), daemon=True
+    )
+    job.start()
+    _palette_jobs[key] = job
+    threading.Thread(
+        target=_watch_palette_job, args=(job, wallpaper), name="qutely-palette-job", daemon=True
+    ).start()
+    logger.info(f"computing color palette of {wallpaper} in the background (pid {job.pid})")
+
+
+def get_wal_colors() -> dict[str, Any]:
+    try:
+        key = wallpaper_hash(WALLPAPER)
+    except OSError as e:
+        logger.warning(f"cannot read wallpaper, using fallback palette: {e}")
+        return FALLBACK_PALETTE
+    if (palette := _palettes.get(key)) is not None:
+        return palette
+    palette_file = PALETTE_CACHE_DIR / f"{key}.json"
+    try:
+        with palette_file.open("r") as f:
+            palette = _palettes[key] = json.load(f)
+        return palette
+    except (OSError, ValueError):
+        pass
+    if (palette := _palette_from_wal_cache(WALLPAPER)) is not None:
+        _write_palette(palette, palette_file)
+        _palettes[key] = palette
+        return palette
+    _start_palette_job(WALLPAPER, palette_file)
+    return FALLBACK_PALETTE
@@ -3,6 +3,7 @@ from typing import Iterable
 from libqtile.config import Match
 from libqtile.layout import Floating
 from libqtile.backend.x11.window import Window, XWindow
+from qutely.matching import MatchIndex
 
 
 ZOOM_PATTERN = re.compile("^join.*action")
@@ -90,3 +91,7 @@ def generate_floating_rules(rules: dict[str, Iterable[str]]) -> Iterable[Match]:
 
 def get_floating_rules() -> list[Match]:
     return list(generate_floating_rules(rules))
+
+
+def get_floating_matcher() -> MatchIndex:
+    return MatchIndex(generate_floating_rules(rules))
@@ -0,0 +1,196 @@
+"""Color temperature and brightness of all screens via RandR gamma ramps.
+
+Replaces the shiftred spawns: the ramps are computed here and set on every CRTC
+through qtile's own X connection. Changes fade in on the event loop and the last
+setting is restored on startup.
+"""
+from __future__ import annotations
+
+import json
+import math
+import asyncio
+from functools import lru_cache
+from typing import Any, NamedTuple, Optional
+
+import xcffib
+
+from libqtile.log_utils import logger
+from qutely.profiling import CACHE_DIR, subscribe
+from qutely.xconn import get_connection, get_root
+
+STATE_FILE = CACHE_DIR / "gamma.json"
+NEUTRAL_TEMPERATURE = 6500
+MIN_TEMPERATURE = 1000
+MAX_TEMPERATURE = 10000
+TEMPERATURE_STEP = 250
+# temperatures are rounded to this during transitions, so the ramps are reused
+TEMPERATURE_QUANTUM = 50
+TRANSITION_DURATION = 0.4
+FRAME_INTERVAL = 1 / 30
+
+Ramp = tuple[tuple[int, ...], tuple[int, ...], tuple[int, ...]]
+
+
+class GammaSetting(NamedTuple):
+    temperature: int = NEUTRAL_TEMPERATURE
+    brightness: float = 1.0
+
+    def clamped(self) -> GammaSetting:
+        return GammaSetting(
+            min(max(int(self.temperature), MIN_TEMPERATURE), MAX_TEMPERATURE),
+            round(min(max(self.brightness, 0.1), 1.0), 2),
+        )
+
+    def quantized(self) -> GammaSetting:
+        temperature = round(self.temperature / TEMPERATURE_QUANTUM) * TEMPERATURE_QUANTUM
+        return GammaSetting(temperature, round(self.brightness, 2))
+
+
+def _blackbody(temperature: float) -> tuple[float, float, float]:
+    # Tanner Helland's fit of the blackbody colors, in 0..255
+    t = temperature / 100
+    if t <= 66:
+        r = 255.0
+        g = 99.4708025861 * math.log(t) - 161.1195681661
+    else:
+        r = 329.698727446 * (t - 60) ** -0.1332047592
+        g = 288.1221695283 * (t - 60) ** -0.0755148492
+    if t >= 66:
+        b = 255.0
+    elif t <= 19:
+        b = 0.0
+    else:
+        b = 138.5177312231 * math.log(t - 10) - 305.0447927307
+    return r, g, b
+
+
+@lru_cache(maxsize=None)
+def kelvin_to_rgb(temperature: int) -> tuple[float, float, float]:
+    """Return the channel multipliers for ``temperature``, 1 for the neutral temperature."""
+    neutral = _blackbody(NEUTRAL_TEMPERATURE)
+    return tuple(  # type: ignore[return-value]
+        min(max(c / n, 0.0), 1.0) for c, n in zip(_blackbody(temperature), neutral)
+    )
+
+
+@lru_cache(maxsize=256)
+def gamma_ramp(size: int, setting: GammaSetting) -> Ramp:
+    top = max(size - 1, 1)
+    return tuple(  # type: ignore[return-value]
+        tuple(int(65535 * i / top * factor * setting.brightness) for i in range(size))
+        for factor in kelvin_to_rgb(setting.temperature)
+    )
+
+
+class GammaController:
+    def __init__(self, state_file: Any = STATE_FILE) -> None:
+        self.state_file = state_file
+        # the screens keep their ramps over a config reload, so start from the saved setting
+        self.current = self.target = self.load()
+        self.transition: Optional[asyncio.Task[None]] = None
+        # crtc -> gamma ramp size, queried once per screen configuration
+        self._crtcs: Optional[dict[int, int]] = None
+
+    def forget_crtcs(self) -> None:
+        self._crtcs = None
+
+    def _get_crtcs(self, conn: xcffib.Connection, randr: Any) -> dict[int, int]:
+        if self._crtcs is None:
+            resources = randr.GetScreenResourcesCurrent(get_root(conn)).reply()
+            cookies = {crtc: randr.GetCrtcGammaSize(crtc) for crtc in resources.crtcs}
+            self._crtcs = {crtc: cookie.reply().size for crtc, cookie in cookies.items()}
+        return self._crtcs
+
+    def apply(self, setting: GammaSetting) -> None:
+        from qutely.randr import get_randr
+
+        conn = get_connection()
+        randr = get_randr(conn)
+        setting = setting.quantized()
+        for crtc, size in self._get_crtcs(conn, randr).items():
+            if size:
+                randr.SetCrtcGamma(crtc, size, *gamma_ramp(size, setting))
+        conn.flush()
+        self.current = setting
+
+    async def fade(self, start: GammaSetting, end: GammaSetting, duration: float) -> None:
+        loop = asyncio.get_running_loop()
+        begin = loop.time()
+        try:
+            while (progress := (loop.time() - begin) / duration) < 1:
+                self.apply(
+                    GammaSetting(
+                        round(start.temperature + (end.temperature - start.temperature) * progress),
+                        start.brightness + (end.brightness - start.brightness) * progress,
+                    )
+                )
+                await asyncio.sleep(FRAME_INTERVAL)
+            self.apply(end)
+        except xcffib.XcffibException as e:
+            logger.error(f"cannot set the gamma ramps: {e}")
+            return
+        self.save()
+
+    def set(self, setting: GammaSetting, duration: float = TRANSITION_DURATION) -> Optional[asyncio.Task[None]]:
+        """Move to ``setting``, fading from the current one if ``duration`` is given."""
+        self.target = setting = setting.clamped()
+        if self.transition is not None:
+            self.transition.cancel()
+            self.transition = None
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            duration = 0
+        if duration <= 0:
+            self.apply(setting)
+            self.save()
+            return None
+        self.transition = asyncio.create_task(self.fade(self.current, setting, duration))
+        return self.transition
+
+    def save(self) -> None:
+        try:
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            self.state_file.write_text(json.dumps(self.target._asdict()))
+        except OSError as e:
+            logger.warning(f"cannot save the gamma setting to {self.state_file}: {e}")
+
+    def load(self) -> GammaSetting:
+        try:
+            return GammaSetting(**json.loads(self.state_file.read_text())).clamped()
+        except FileNotFoundError:
+            return GammaSetting()
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"invalid gamma setting in {self.state_file}: {e}")
+            return GammaSetting()
+
+    async def set_temperature(self, temperature: int, brightness: Optional[float] = None) -> None:
+        self.set(GammaSetting(temperature, self.target.brightness if brightness is None else brightness))
+
+    async def redder(self, *_: Any) -> None:
+        await self.set_temperature(self.target.temperature - TEMPERATURE_STEP)
+
+    async def bluer(self, *_: Any) -> None:
+        await self.set_temperature(self.target.temperature + TEMPERATURE_STEP)
+
+    async def restore(self) -> None:
+        self.set(self.load())
+
+
+# config reloads re-execute this module, restore_gamma only runs on startup
+controller: GammaController = globals().get("controller") or GammaController()
+
+
+@subscribe.startup_complete
+async def restore_gamma() -> None:
+    try:
+        await controller.restore()
+    except Exception as e:
+        logger.error(f"cannot restore the gamma setting: {e}", exc_info=True)
+
+
+@subscribe.screens_reconfigured
+async def reapply_gamma() -> None:
+    # new crtcs start with a linear ramp
+    controller.forget_crtcs()
+    controller.set(controller.target, duration=0)
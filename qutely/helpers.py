@@ -7,12 +7,16 @@ from libqtile.lazy import lazy, LazyCall
 
 
 def lazy_coro(f: Awaitable[Any], *args: Any, **kwargs: Any) -> LazyCall:
-    return lazy.function(
-        lambda qtile: qtile.call_soon(asyncio.create_task, f(qtile, *args, **kwargs))
-    )
+    def start(qtile: Any) -> asyncio.Task[Any]:
+        return asyncio.create_task(f(qtile, *args, **kwargs))
+
+    start.__name__ = start.__qualname__ = getattr(f, "__name__", "coroutine")
+    return lazy.function(start)
 
 
 def call_soon(f: Awaitable[Any], *args: Any, **kwargs: Any) -> LazyCall:
-    return lazy.function(
-        lambda qtile: qtile.call_soon(asyncio.create_task, f(*args, **kwargs))
-    )
+    def start(qtile: Any) -> asyncio.Task[Any]:
+        return asyncio.create_task(f(*args, **kwargs))
+
+    start.__name__ = start.__qualname__ = getattr(f, "__name__", "coroutine")
+    return lazy.function(start)
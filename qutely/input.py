@@ -0,0 +1,283 @@
+"""Keymaps and input device properties over the XKB and XInput2 extensions.
+
+Replaces the setxkbmap and xinput spawns: the keymap is loaded by its KcCGST
+component names with XkbGetKbdByName, device properties are written with
+XIChangeProperty. Both are applied again when an input device is plugged in.
+"""
+from __future__ import annotations
+
+import io
+import re
+import struct
+import asyncio
+from functools import lru_cache
+from typing import Any, NamedTuple, Optional
+
+import xcffib
+import xcffib.xinput
+import xcffib.xkb
+import xcffib.xproto
+from xcffib.xinput import DeviceType, HierarchyMask
+
+from libqtile.log_utils import logger
+from qutely.profiling import subscribe
+from qutely.xconn import EventWatcher, get_connection, get_extension, get_root, intern_atom, to_str
+
+XKB_VERSION = (1, 0)
+XI_VERSION = (2, 2)
+RULES = "evdev"
+MODEL = "pc105"
+REGEX_PREFIX = "re:"
+# plugging in a device produces several hierarchy events in a row
+HOTPLUG_DELAY = 0.5
+
+# layouts whose keycode aliases differ from the default qwerty ones (from the evdev rules)
+KEYCODE_ALIASES = {"de": "qwertz", "at": "qwertz", "ch": "qwertz", "cz": "qwertz", "fr": "azerty", "be": "azerty"}
+# setxkbmap -option values and the component they are appended to
+OPTIONS = {
+    "compose:menu": ("symbols", "compose(menu)"),
+    "compose:ralt": ("symbols", "compose(ralt)"),
+    "caps:escape": ("symbols", "capslock(escape)"),
+    "ctrl:nocaps": ("symbols", "ctrl(nocaps)"),
+    "grp_led:scroll": ("compat", "ledscroll(group_lock)"),
+}
+
+KEYMAP = "de deadacute"
+# device name (or "re:" pattern) -> property name -> values
+DEVICE_PROPERTIES: dict[str, dict[str, list[int]]] = {
+    "re:touchpad": {"libinput Tapping Enabled": [1]},
+}
+
+
+class Components(NamedTuple):
+    keycodes: str
+    types: str
+    compat: str
+    symbols: str
+    geometry: str
+
+
+class Keymap(NamedTuple):
+    layout: str
+    variant: str = ""
+    options: tuple[str, ...] = ()
+
+    @classmethod
+    def parse(cls, spec: str, options: Optional[str] = None) -> Keymap:
+        """Parse "layout [variant]" and "opt1,opt2" as given to setxkbmap."""
+        layout, _, variant = spec.strip().partition(" ")
+        return cls(layout, variant.strip(), tuple(o for o in (options or "").split(",") if o))
+
+    def __str__(self) -> str:
+        return f"{self.layout} {self.variant}" if self.variant else self.layout
+
+
+@lru_cache(maxsize=None)
+def get_components(keymap: Keymap) -> Components:
+    """Resolve a keymap into component names like the evdev rules do for the pc105 model."""
+    if not re.fullmatch(r"[\w-]+", keymap.layout) or not re.fullmatch(r"[\w-]*", keymap.variant):
+        raise ValueError(f"invalid keymap: {keymap}")
+    symbols = f"{keymap.layout}({keymap.variant})" if keymap.variant else keymap.layout
+    parts = {"symbols": [f"pc+{symbols}+inet(evdev)"], "compat": ["complete"]}
+    for option in keymap.options:
+        if option not in OPTIONS:
+            raise ValueError(f"unsupported xkb option: {option}")
+        component, name = OPTIONS[option]
+        parts[component].append(name)
+    return Components(
+        keycodes=f"evdev+aliases({KEYCODE_ALIASES.get(keymap.layout, 'qwerty')})",
+        types="complete",
+        compat="+".join(parts["compat"]),
+        symbols="+".join(parts["symbols"]),
+        geometry=f"pc({MODEL})",
+    )
+
+
+def get_xkb(conn: xcffib.Connection) -> Any:
+    return get_extension(conn, xcffib.xkb, *XKB_VERSION, version_request="UseExtension")
+
+
+def get_xinput(conn: xcffib.Connection) -> Any:
+    return get_extension(conn, xcffib.xinput, *XI_VERSION, version_request="XIQueryVersion")
+
+
+def _counted_string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack("=B", len(data)) + data
+
+
+def get_kbd_by_name(xkb: Any, components: Components, device: int = xcffib.xkb.ID.UseCoreKbd) -> Any:
+    # xcffib has no request for this: xcb-proto leaves out the component names
+    buf = io.BytesIO()
+    # need and want are empty, load makes the server compile the whole keymap anyway
+    buf.write(struct.pack("=xx2xHHHBx", device, 0, 0, True))
+    for name in ("", *components):
+        buf.write(_counted_string(name))
+    buf.write(b"\0" * (-buf.tell() % 4))
+    return xkb.send_request(23, buf, xcffib.xkb.GetKbdByNameCookie, is_checked=True)
+
+
+def set_rules_names(conn: xcffib.Connection, keymap: Keymap) -> None:
+    # read by setxkbmap -query and the keyboard layout widget
+    value = "\0".join([RULES, MODEL, keymap.layout, keymap.variant, ",".join(keymap.options)]) + "\0"
+    conn.core.ChangeProperty(
+        xcffib.xproto.PropMode.Replace,
+        get_root(conn),
+        intern_atom(conn, "_XKB_RULES_NAMES"),
+        xcffib.xproto.Atom.STRING,
+        8,
+        len(value),
+        value.encode(),
+    )
+
+
+def get_rules_names(conn: Optional[xcffib.Connection] = None) -> Optional[Keymap]:
+    conn = conn or get_connection()
+    reply = conn.core.GetProperty(
+        False, get_root(conn), intern_atom(conn, "_XKB_RULES_NAMES"), xcffib.xproto.Atom.STRING, 0, 1024
+    ).reply()
+    if not reply.value_len:
+        return None
+    values = to_str(reply.value).split("\0")
+    if len(values) < 5:
+        return None
+    return Keymap(values[2], values[3], tuple(o for o in values[4].split(",") if o))
+
+
+def load_keymap(keymap: Keymap, conn: Optional[xcffib.Connection] = None) -> bool:
+    conn = conn or get_connection()
+    reply = get_kbd_by_name(get_xkb(conn), get_components(keymap)).reply()
+    if not reply.loaded:
+        logger.error(f"the x server could not load the keymap {keymap}: {get_components(keymap)}")
+        return False
+    set_rules_names(conn, keymap)
+    conn.flush()
+    return True
+
+
+def _matches(pattern: str, name: str) -> bool:
+    if pattern.startswith(REGEX_PREFIX):
+        return re.search(pattern[len(REGEX_PREFIX):], name, re.I) is not None
+    return pattern == name
+
+
+def _change_property(xinput: Any, device: int, prop: int, type: int, format: int, values: list[int]) -> None:
+    # xcffib's XIChangeProperty pads 8 and 16 bit data wrongly
+    buf = io.BytesIO()
+    buf.write(struct.pack("=xx2xHBBIII", device, xcffib.xproto.PropMode.Replace, format, prop, type, len(values)))
+    code = {8: "B", 16: "H", 32: "I"}[format]
+    buf.write(struct.pack(f"={len(values)}{code}", *values))
+    buf.write(b"\0" * (-buf.tell() % 4))
+    xinput.send_request(57, buf)
+
+
+def apply_device_properties(
+    properties: dict[str, dict[str, list[int]]] = DEVICE_PROPERTIES,
+    conn: Optional[xcffib.Connection] = None,
+    devices: Optional[set[int]] = None,
+) -> None:
+    conn = conn or get_connection()
+    xinput = get_xinput(conn)
+    infos = xinput.XIQueryDevice(xcffib.xinput.Device.All).reply().infos
+    atoms = {name: intern_atom(conn, name, only_if_exists=True) for props in properties.values() for name in props}
+    pending = []
+    for info in infos:
+        if info.type not in (DeviceType.SlavePointer, DeviceType.SlaveKeyboard, DeviceType.FloatingSlave):
+            continue
+        if devices is not None and info.deviceid not in devices:
+            continue
+        name = to_str(info.name)
+        for pattern, props in properties.items():
+            if not _matches(pattern, name):
+                continue
+            for prop, values in props.items():
+                if not atoms[prop]:
+                    continue
+                # the property's type and format are needed for the write
+                cookie = xinput.XIGetProperty(info.deviceid, False, atoms[prop], 0, 0, len(values))
+                pending.append((info.deviceid, name, prop, values, cookie))
+    for device, name, prop, values, cookie in pending:
+        try:
+            reply = cookie.reply()
+        except xcffib.xproto.AtomError:
+            continue
+        if not reply.type:
+            # the device does not have this property
+            continue
+        current = list(getattr(reply, f"data{reply.format}", []))
+        if current == values:
+            continue
+        logger.info(f"setting '{prop}' of {name} to {values}")
+        _change_property(xinput, device, atoms[prop], reply.type, reply.format, values)
+    conn.flush()
+
+
+class InputConfig:
+    def __init__(self, keymap: str = KEYMAP, properties: dict[str, dict[str, list[int]]] = DEVICE_PROPERTIES) -> None:
+        self.keymap = Keymap.parse(keymap)
+        self.properties = properties
+        self.watcher: Optional[EventWatcher] = None
+        self.pending: Optional[asyncio.TimerHandle] = None
+        self.added: set[int] = set()
+
+    def set_keymap(self, keymap: Keymap) -> bool:
+        try:
+            loaded = load_keymap(keymap)
+        except (ValueError, xcffib.XcffibException) as e:
+            logger.error(f"cannot load the keymap {keymap}: {e}")
+            return False
+        if loaded:
+            self.keymap = keymap
+        return loaded
+
+    def apply(self, devices: Optional[set[int]] = None) -> None:
+        try:
+            load_keymap(self.keymap)
+            apply_device_properties(self.properties, devices=devices)
+        except xcffib.XcffibException as e:
+            logger.error(f"cannot configure the input devices: {e}")
+
+    def start(self) -> None:
+        self.apply()
+        if self.watcher is None:
+            self.watcher = EventWatcher(self._select_hierarchy, self._on_event)
+            self.watcher.start()
+
+    def stop(self) -> None:
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    @staticmethod
+    def _select_hierarchy(conn: xcffib.Connection) -> None:
+        mask = xcffib.xinput.EventMask.synthetic(xcffib.xinput.Device.All, 1, [xcffib.xinput.XIEventMask.Hierarchy])
+        get_xinput(conn).XISelectEvents(get_root(conn), 1, [mask])
+
+    def _on_event(self, event: Any) -> None:
+        if not isinstance(event, xcffib.xinput.HierarchyEvent):
+            return
+        if not event.flags & (HierarchyMask.SlaveAdded | HierarchyMask.DeviceEnabled):
+            return
+        self.added.update(
+            info.deviceid
+            for info in event.infos
+            if info.flags & (HierarchyMask.SlaveAdded | HierarchyMask.DeviceEnabled)
+        )
+        if self.pending is not None:
+            self.pending.cancel()
+        self.pending = asyncio.get_running_loop().call_later(HOTPLUG_DELAY, self._on_hotplug)
+
+    def _on_hotplug(self) -> None:
+        devices, self.added = self.added, set()
+        self.pending = None
+        logger.info(f"input devices {sorted(devices)} added, applying the input configuration")
+        self.apply(devices)
+
+
+# config reloads re-execute this module, the hotplug watcher stays bound to this instance
+config: InputConfig = globals().get("config") or InputConfig()
+
+
+@subscribe.startup_complete
+def configure_input() -> None:
+    config.start()
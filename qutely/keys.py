@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+import time
 import asyncio
 import shlex
+from typing import Any, NamedTuple, Optional
 from qutely.procs import Proc
 from libqtile.config import EzKey
 from libqtile.command.client import InteractiveCommandClient
 from libqtile.lazy import lazy, LazyCall
 from libqtile.utils import logger
-from qutely.debug import in_debug_mode
+from qutely.debug import in_debug_mode, profile_keys
+from qutely.profiling import get_sampler, key_stats
 from qutely.util import (
     decrease_kitty_font_size,
     increase_kitty_font_size,
@@ -31,6 +34,11 @@ from qutely.util import (
     provide_terminal,
 )
 from qutely.helpers import call_soon, lazy_coro
+from qutely.display import apply_screen_profile
+from qutely.audio import controller as audio
+from qutely.gamma import controller as gamma
+from qutely.opacity import OPACITY_STEP, step_opacity
+from qutely.synth import Synth
 
 modifier_keys = {
     "M": "M",
@@ -61,9 +69,154 @@ else:
 mod_key = inverse_modifier_keys[mod_abbrev]
 
 
+def known_layout_names() -> set[str]:
+    from libqtile import layout
+    from libqtile.layout.base import Layout
+
+    return {
+        cls.__name__.lower()
+        for cls in vars(layout).values()
+        if isinstance(cls, type) and issubclass(cls, Layout)
+    }
+
+
+def run_action(qtile: Any, action: LazyCall) -> Any:
+    return qtile.select(action.selectors).command(action.name)(*action.args, **action.kwargs)
+
+
+def describe_action(action: LazyCall) -> str:
+    if isinstance(action, LayoutDispatch):
+        return "|".join(f"{layout}:{describe_action(a)}" for layout, a in action.actions.items())
+    if action.name == "spawn" and action.args:
+        return str(action.args[0])
+    if action.name == "function" and action.args:
+        owner = getattr(action.args[0], "__self__", None)
+        if isinstance(owner, Coalescer):
+            return owner.spec.cmd
+        if isinstance(owner, Synth):
+            return f"key {' '.join(owner.keys)}"
+        return getattr(action.args[0], "__name__", "function")
+    path = ".".join(name for name, _ in action.selectors)
+    return f"{path}.{action.name}" if path else action.name
+
+
+class LayoutDispatch(LazyCall):
+    """Run the action bound to the name of the current layout.
+
+    One dict lookup per press instead of one ``.when(layout=...)`` check per
+    layout. ``fallback`` is run for all other layouts.
+    """
+
+    def __init__(self, actions: dict[str, LazyCall], fallback: Optional[LazyCall] = None) -> None:
+        call = lazy.function(self.run)
+        super().__init__(call._call, call._args, call._kwargs)
+        self.actions = actions
+        self.fallback = fallback
+
+    def select(self, q: Any) -> Optional[LazyCall]:
+        return self.actions.get(q.current_layout.name, self.fallback)
+
+    def check(self, q: Any) -> bool:
+        if not super().check(q):
+            return False
+        action = self.select(q)
+        return action is not None and action.check(q)
+
+    def run(self, qtile: Any) -> Any:
+        if (action := self.select(qtile)) is not None:
+            return run_action(qtile, action)
+
+
+class Coalesce(NamedTuple):
+    """Mark a spawn binding whose key repeats are merged into one invocation.
+
+    ``cmd`` may contain ``{count}`` (number of presses) and ``{amount}``
+    (``count * step``). Presses while the previous process is still running or
+    within ``window`` seconds of its start are accumulated for the next run.
+    Commands without placeholders are run at most once per window.
+    """
+
+    cmd: str
+    step: float = 1
+    window: float = 0.1
+    timeout: int = 10
+
+    def args(self, count: int) -> list[str]:
+        amount = round(count * self.step, 6)
+        return shlex.split(self.cmd.format(count=count, amount=amount))
+
+
+class Coalescer:
+    def __init__(self, spec: Coalesce) -> None:
+        self.spec = spec
+        self.count = 0
+        self.task: Optional[asyncio.Task[None]] = None
+
+    def press(self, qtile: Any) -> asyncio.Task[None]:
+        self.count += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.drain())
+        return self.task
+
+    async def drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.count:
+            count, self.count = self.count, 0
+            start = loop.time()
+            await Proc(*self.spec.args(count), timeout=self.spec.timeout).run()
+            await asyncio.sleep(max(0.0, self.spec.window - (loop.time() - start)))
+
+
+class TimedCall(LazyCall):
+    """Run ``action`` and record the time from the key press to its completion.
+
+    The press is taken from the check right before qtile dispatches the call. For
+    spawns, completion is the fork of the process, for coroutines the end of the task.
+    """
+
+    def __init__(self, key: str, action: LazyCall) -> None:
+        call = lazy.function(self.run)
+        super().__init__(call._call, call._args, call._kwargs)
+        self.action = action
+        self.stats_name = f"{key} {describe_action(action)}"
+        self.pressed = 0.0
+
+    def check(self, q: Any) -> bool:
+        if not self.action.check(q):
+            return False
+        self.pressed = time.perf_counter()
+        return True
+
+    def record(self, start: float, failed: bool) -> None:
+        key_stats.record(self.stats_name, time.perf_counter() - start, failed)
+
+    def run(self, qtile: Any) -> Any:
+        start = self.pressed or time.perf_counter()
+        self.pressed = 0.0
+        action = self.action
+        try:
+            res = run_action(qtile, action)
+        except Exception:
+            self.record(start, failed=True)
+            raise
+        if isinstance(res, asyncio.Future):
+            res.add_done_callback(
+                lambda f: self.record(start, failed=f.cancelled() or f.exception() is not None)
+            )
+        else:
+            self.record(start, failed=False)
+        return res
+
+
 class KeyList(list):
-    def __init__(self, key_dict):
+    def __init__(self, key_dict, measure_latency: bool = profile_keys, layout_names: Optional[set[str]] = None):
         super().__init__()
+        self.measure_latency = measure_latency
+        self.layout_names = layout_names or known_layout_names()
+        if measure_latency:
+            sampler = get_sampler()
+            if key_stats not in sampler.registries:
+                sampler.registries.append(key_stats)
         self.add_keys(key_dict)
 
     def add_keys(self, key_dict, **kwargs):
@@ -73,10 +226,13 @@ class KeyList(list):
             try:
                 self.add_key(k, vs)
             except Exception as e:
-                raise ValueError(f"cannot parse key {k=}, {vs=}, {vs.name}") from e
+                raise ValueError(f"cannot parse key {k=}, {vs=}") from e
 
     def add_key(self, k, vs):
-        entry = EzKey(self.parse_key(k), *self.as_command(vs))
+        actions = self.as_command(vs)
+        if self.measure_latency:
+            actions = [TimedCall(k, action) for action in actions]
+        entry = EzKey(self.parse_key(k), *actions)
         self.append(entry)
 
     def __setitem__(self, k, vs):
@@ -89,45 +245,60 @@ class KeyList(list):
         else:
             return key
 
-    @staticmethod
-    def as_command(args):
+    def as_command(self, args):
         if isinstance(args, (list, tuple)):
             cmds = args
         elif isinstance(args, dict):
-            cmds = []
-            for ks, v in args.items():
-                if isinstance(ks, tuple):
-                    subks = ks
-                elif isinstance(ks, str):
-                    subks = [ks]
-                else:
-                    raise TypeError(
-                        "wrong type for key. expected: (str, list, tuple). got: %s"
-                        % type(ks)
-                    )
-                for k in subks:
-                    cmd = v()
-                    if k:
-                        cmd.when(layout=k)
-                    cmds.append(cmd)
+            cmds = [self.as_layout_dispatch(args)]
         else:
             cmds = [args]
 
-        li = []
-        for cmd in cmds:
-            logger.debug(cmd)
-            if isinstance(cmd, str):
-                action = lazy.spawn(cmd)
-            elif isinstance(cmd, LazyCall):
-                action = cmd
-            elif isinstance(cmd, InteractiveCommandClient):
-                action = cmd()
-            elif asyncio.iscoroutinefunction(cmd):
-                action = lazy_coro(cmd)
+        return [self.as_action(cmd) for cmd in cmds]
+
+    def as_layout_dispatch(self, args):
+        """Compile ``{layout name or names: action}`` into a LayoutDispatch.
+
+        An empty name ("" or None) binds the fallback for all other layouts.
+        """
+        actions = {}
+        fallback = None
+        for ks, v in args.items():
+            if isinstance(ks, tuple):
+                subks = ks
+            elif isinstance(ks, str) or ks is None:
+                subks = [ks]
             else:
-                action = cmd()
-            li.append(action)
-        return li
+                raise TypeError(
+                    "wrong type for key. expected: (str, list, tuple). got: %s"
+                    % type(ks)
+                )
+            action = self.as_action(v)
+            for k in subks:
+                if not k:
+                    fallback = action
+                elif k not in self.layout_names:
+                    raise ValueError(f"unknown layout {k!r}, expected one of {', '.join(sorted(self.layout_names))}")
+                else:
+                    actions[k] = action
+        return LayoutDispatch(actions, fallback)
+
+    @staticmethod
+    def as_action(cmd):
+        logger.debug(cmd)
+        if isinstance(cmd, str):
+            return lazy.spawn(cmd)
+        elif isinstance(cmd, Coalesce):
+            return lazy.function(Coalescer(cmd).press)
+        elif isinstance(cmd, Synth):
+            return lazy.function(cmd.run)
+        elif isinstance(cmd, LazyCall):
+            return cmd
+        elif isinstance(cmd, InteractiveCommandClient):
+            return cmd()
+        elif asyncio.iscoroutinefunction(cmd):
+            return lazy_coro(cmd)
+        else:
+            return cmd()
 
 
 @lazy.function
@@ -163,12 +334,12 @@ keys = KeyList(
         "M-S-j": lazy.layout.shuffle_down,
         "M-S-k": lazy.layout.shuffle_up,
         "M-C-h": {
-            ("bsp", "column"): lazy.layout.grow_left,
+            ("bsp", "columns"): lazy.layout.grow_left,
             "treetab": lazy.layout.decrease_ratio,
             "monadtall": lazy.layout.shrink_main,
         },
         "M-C-l": {
-            ("bsp", "column"): lazy.layout.grow_right,
+            ("bsp", "columns"): lazy.layout.grow_right,
             "treetab": lazy.layout.increase_ratio,
             "monadtall": lazy.layout.grow_main,
         },
@@ -196,18 +367,18 @@ keys = KeyList(
         "M-p": history_back,
         "M-S-p": history_forward,
         "M-<Return>": provide_terminal,
-        "M-<minus>": "xdotool key Menu",
+        "M-<minus>": Synth("Menu"),
         "M-<Up>": call_soon(render_kitty_config, 1),
         "M-<Down>": call_soon(render_kitty_config, -1),
-        "M-S-<Left>": "shiftred r-",
-        "M-S-<Right>": "shiftred r+",
+        "M-S-<Left>": call_soon(gamma.bluer),
+        "M-S-<Right>": call_soon(gamma.redder),
         "M-S-<Down>": lazy.widget["brightness"].brightness_down(),
         "M-S-<Up>": lazy.widget["brightness"].brightness_up(),
-        "M-S-0": "shiftred 5100:.8",
-        "M-0": "shiftred 5800:1",
-        "M-C-0": "shiftred 6500:1",
-        "M-<Prior>": "transset --actual --dec 0.025",
-        "M-<Next>": "transset --actual --inc 0.025",
+        "M-S-0": call_soon(gamma.set_temperature, 5100, 0.8),
+        "M-0": call_soon(gamma.set_temperature, 5800, 1.0),
+        "M-C-0": call_soon(gamma.set_temperature, 6500, 1.0),
+        "M-<Prior>": lazy.function(step_opacity, -OPACITY_STEP),
+        "M-<Next>": lazy.function(step_opacity, OPACITY_STEP),
         "M-<plus>": "rofi -i -show window",
         "M-S-<plus>": r"rofi-run\ in\ terminal-menu",
         "M-<numbersign>": "rofi -i -show run",
@@ -223,18 +394,18 @@ keys = KeyList(
         "M-C-p": lock_screen,
         "M-C-S-p": suspend,
         "M-C-A-p": "reconfigure-and-hibernate",
-        "M-<F1>": "configure-screens laptop",
-        "M-<F2>": "configure-screens home",
-        "M-<F3>": "configure-screens work",
-        "M-<F4>": "configure-screens large-screen",
-        "<XF86AudioMute>": "configure-volume --toggle",
-        "<XF86AudioLowerVolume>": "configure-volume --down",
-        "<XF86AudioRaiseVolume>": "configure-volume --up",
-        "<XF86AudioMicMute>": "configure-volume --toggle-mic",
-        "S-<XF86AudioMute>": "configure-volume --toggle-mic",
-        "S-<XF86AudioLowerVolume>": "configure-volume --down-mic",
-        "S-<XF86AudioRaiseVolume>": "configure-volume --up-mic",
-        "C-<XF86AudioMute>": "configure-volume --mute-all",
+        "M-<F1>": lazy_coro(apply_screen_profile, "laptop"),
+        "M-<F2>": lazy_coro(apply_screen_profile, "home"),
+        "M-<F3>": lazy_coro(apply_screen_profile, "work"),
+        "M-<F4>": lazy_coro(apply_screen_profile, "large-screen"),
+        "<XF86AudioMute>": call_soon(audio.toggle_mute),
+        "<XF86AudioLowerVolume>": call_soon(audio.volume_down),
+        "<XF86AudioRaiseVolume>": call_soon(audio.volume_up),
+        "<XF86AudioMicMute>": call_soon(audio.toggle_mic),
+        "S-<XF86AudioMute>": call_soon(audio.toggle_mic),
+        "S-<XF86AudioLowerVolume>": call_soon(audio.mic_down),
+        "S-<XF86AudioRaiseVolume>": call_soon(audio.mic_up),
+        "C-<XF86AudioMute>": call_soon(audio.mute_all),
         "M-i": lazy.widget["checkclockwidget"].toggle_paused(),
         "M-S-i": lazy.widget["checkclockwidget"].show_schedule(),
         "M-<F6>": create_popup,
@@ -242,7 +413,7 @@ keys = KeyList(
         "M-S-v": lazy.group["ding_scratchpad"].dropdown_toggle("ding"),
         "M-C-v": lazy.group["telegram_scratchpad"].dropdown_toggle("telegram"),
         "M-A-v": lazy.group["neochat_scratchpad"].dropdown_toggle("neochat"),
-        "M-S-g": "xdotool key Return",
+        "M-S-g": Synth("Return"),
         "M-o": "dunstctl close",
         "M-S-o": "dunstctl close-all",
         "M-C-o": "dunstctl history-pop",
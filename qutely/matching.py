@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Callable, Iterable, Optional
+
+from libqtile.config import Match
+
+# properties that can be indexed and how to read them from a client
+PROPERTIES: dict[str, Callable[[Any], Any]] = {
+    "wm_class": lambda client: client.get_wm_class(),
+    "wm_instance_class": lambda client: (client.get_wm_class() or [None])[0],
+    "title": lambda client: client.name,
+    "role": lambda client: client.get_wm_role(),
+    "wm_type": lambda client: client.get_wm_type(),
+}
+
+
+class MatchIndex:
+    """Compare a window against many rules at once.
+
+    Matches on a single property with an exact string are looked up in a set,
+    regular expressions on the same property are folded into one alternation.
+    Everything else (several properties per match, functions, pids, inverted or
+    combined matches) is compared one by one as qtile would do.
+
+    Behaves like a ``Match`` (matching any of the indexed rules), so it can be
+    used for ``Floating(float_rules=...)`` or a group's ``matches``.
+    """
+
+    def __init__(self, matches: Iterable[Any] = ()) -> None:
+        self.exact: dict[str, set[str]] = {}
+        self.patterns: dict[str, list[re.Pattern[str]]] = {}
+        self.fallback: list[Any] = []
+        self.compiled: dict[str, list[re.Pattern[str]]] = {}
+        for match in matches:
+            self.add(match)
+
+    def __len__(self) -> int:
+        return (
+            sum(len(v) for v in self.exact.values())
+            + sum(len(v) for v in self.patterns.values())
+            + len(self.fallback)
+        )
+
+    def __repr__(self) -> str:
+        return f"<MatchIndex exact={self.exact} patterns={self.patterns} fallback={self.fallback}>"
+
+    def add(self, match: Any) -> None:
+        rules = getattr(match, "_rules", None) if type(match) is Match else None
+        if not rules or len(rules) != 1:
+            self.fallback.append(match)
+            return
+        ((prop, value),) = rules.items()
+        if prop not in PROPERTIES:
+            self.fallback.append(match)
+        elif isinstance(value, str):
+            self.exact.setdefault(prop, set()).add(value)
+        elif isinstance(value, re.Pattern):
+            self.patterns.setdefault(prop, []).append(value)
+            self.compiled.pop(prop, None)
+        else:
+            self.fallback.append(match)
+
+    def extend(self, matches: Iterable[Any]) -> None:
+        for match in matches:
+            self.add(match)
+
+    def _compiled(self, prop: str) -> list[re.Pattern[str]]:
+        if (compiled := self.compiled.get(prop)) is not None:
+            return compiled
+        by_flags: dict[int, list[str]] = {}
+        for pattern in self.patterns[prop]:
+            by_flags.setdefault(pattern.flags, []).append(pattern.pattern)
+        compiled = []
+        for flags, sources in by_flags.items():
+            try:
+                compiled.append(re.compile("|".join(f"(?:{s})" for s in sources), flags))
+            except re.error:
+                # e.g. group names or back references that clash in an alternation
+                compiled.extend(re.compile(s, flags) for s in sources)
+        self.compiled[prop] = compiled
+        return compiled
+
+    def _matches_property(self, prop: str, value: Any) -> bool:
+        # like Match, wm_class matches if any of its values does
+        values = value if prop == "wm_class" else (value,)
+        if exact := self.exact.get(prop):
+            if any(v in exact for v in values):
+                return True
+        if prop in self.patterns:
+            for pattern in self._compiled(prop):
+                if any(pattern.match(v) for v in values):
+                    return True
+        return False
+
+    def compare(self, client: Any) -> bool:
+        wm_class: Optional[list[str]] = None
+        for prop in self.exact.keys() | self.patterns.keys():
+            if prop in ("wm_class", "wm_instance_class"):
+                if wm_class is None:
+                    wm_class = client.get_wm_class() or []
+                value = wm_class if prop == "wm_class" else (wm_class or [None])[0]
+            else:
+                value = PROPERTIES[prop](client)
+            if value is None:
+                continue
+            if self._matches_property(prop, value):
+                return True
+        return any(match.compare(client) for match in self.fallback)
+
+    def map(self, callback: Callable[[Any], Any], clients: list[Any]) -> None:
+        for c in clients:
+            if self.compare(c):
+                callback(c)
@@ -1,7 +1,34 @@
-from libqtile import hook
+from __future__ import annotations
+
+import os
+import re
+import json
+import asyncio
+import weakref
+import functools
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+import xcffib.xproto
 from libqtile.backend.x11.window import Window
 from libqtile.log_utils import logger
-from qutely.util import is_light_theme, TERM_CLASS, TERM_SUPPLY_CLASS
+from qutely.util import is_light_theme, on_reload, TERM_CLASS, TERM_SUPPLY_CLASS
+from qutely.profiling import CACHE_DIR, subscribe
+from qutely import window_rules
+from qutely.window_rules import get_class_key, window_props
+
+# rules merged over the tables below, e.g.
+# {"full": {"class": ["re:^steam_app_"]}, "partial": {"class": {"obsidian": 0.95}}}
+# strings prefixed with "re:" are matched as (case insensitive) regular expressions
+OPACITY_RULES_FILE = Path("~/.config/qtile/opacity-rules.json").expanduser()
+# opacities set with the step_opacity bindings, by window class
+OPACITY_OVERRIDES_FILE = CACHE_DIR / "opacity-overrides.json"
+OPACITY_STEP = 0.025
+MIN_OPACITY = 0.1
+SAVE_DELAY = 2.0
+# set to "on" to let picom dim inactive windows instead of writing their opacity from qtile
+PICOM_DIMMING_KEY = "QTILE_PICOM_DIMMING"
+DIM_FACTOR = 0.93
 
 full_opacities = {
     "class": {
@@ -75,107 +102,440 @@ partial_opacities = {
 }
 
 
+class OpacityWriter:
+    """Coalesce the _NET_WM_WINDOW_OPACITY writes of one event loop tick.
+
+    Only the last value per window is written, values equal to the one written
+    before are dropped, and all writes are sent unchecked with a single flush.
+    Windows are only referenced weakly.
+    """
+
+    def __init__(self) -> None:
+        self.written: weakref.WeakKeyDictionary[Window, float] = weakref.WeakKeyDictionary()
+        self.pending: weakref.WeakKeyDictionary[Window, float] = weakref.WeakKeyDictionary()
+        self.scheduled = False
+
+    def get(self, window: Window) -> float:
+        if (value := self.pending.get(window)) is not None:
+            return value
+        if (value := self.written.get(window)) is None:
+            value = self.written[window] = window.opacity
+        return value
+
+    def set(self, window: Window, value: float) -> None:
+        if not 0.0 <= value <= 1.0:
+            return
+        if window not in self.pending and self.written.get(window) == value:
+            return
+        self.pending[window] = value
+        if self.scheduled:
+            return
+        try:
+            asyncio.get_running_loop().call_soon(self.flush)
+            self.scheduled = True
+        except RuntimeError:
+            self.flush()
+
+    def flush(self) -> None:
+        self.scheduled = False
+        pending = list(self.pending.items())
+        self.pending.clear()
+        conn = None
+        for window, value in pending:
+            if self.written.get(window) == value or window.wid not in window.qtile.windows_map:
+                continue
+            conn = window.qtile.core.conn
+            conn.conn.core.ChangeProperty(
+                xcffib.xproto.PropMode.Replace,
+                window.wid,
+                conn.atoms["_NET_WM_WINDOW_OPACITY"],
+                conn.atoms["CARDINAL"],
+                32,
+                1,
+                [int(value * 0xFFFFFFFF)],
+            )
+            self.written[window] = value
+        if conn is not None:
+            conn.flush()
+
+    def clear(self, qtile: Any) -> None:
+        """Delete the opacity of all client windows and forget the values written."""
+        self.pending.clear()
+        self.written.clear()
+        conn = qtile.core.conn
+        for window in qtile.windows_map.values():
+            if isinstance(window, Window):
+                conn.conn.core.DeleteProperty(window.wid, conn.atoms["_NET_WM_WINDOW_OPACITY"])
+        conn.flush()
+
+
+writer = OpacityWriter()
+
+
 def set_opacities(window: Window, dim: bool = True, overwrite: bool = False) -> None:
     if hasattr(window, "_full_opacity") and not overwrite:
         return
-    window._full_opacity = window.opacity
+    window._full_opacity = writer.get(window)
     if dim:
-        window._dimmed_opacity = window._full_opacity * 0.93
+        window._dimmed_opacity = window._full_opacity * DIM_FACTOR
         window._dimmable = True
     else:
-        window._dimmed_opacity = 1.0
+        window._dimmed_opacity = window._full_opacity
         window._dimmable = False
 
 
-previous_window = None
+_previous_window: Optional[weakref.ref[Window]] = None
 
 
-def get_specs(window: Window):
-    classes = window.window.get_wm_class()
-    name = window.window.get_name()
-    role = window.window.get_wm_window_role()
-    type = window.window.get_wm_type()
-    classes = (None, None) if classes is None else [c.lower() for c in classes]
-    name = None if name is None else name.lower()
-    role = None if role is None else role.lower()
-    type = None if type is None else type.lower()
+class OpacitySpec(NamedTuple):
+    full: bool
+    value: float
+
+
+FULL_OPACITY = OpacitySpec(True, 1.0)
+DEFAULT_OPACITY = OpacitySpec(False, 1.0)
+REGEX_PREFIX = "re:"
+
+
+class FieldRules:
+    """Exact matches of one window property plus regexes, tried in order."""
+
+    def __init__(self, rules: dict[Any, Any]) -> None:
+        self.exact: dict[str, Any] = {}
+        self.patterns: list[tuple[re.Pattern[str], Any]] = []
+        for key, value in rules.items():
+            if isinstance(key, re.Pattern):
+                self.patterns.append((key, value))
+            elif key.startswith(REGEX_PREFIX):
+                self.patterns.append((re.compile(key[len(REGEX_PREFIX):], re.I), value))
+            else:
+                self.exact[key.lower()] = value
+
+    def get(self, *values: Optional[str]) -> Any:
+        for value in values:
+            if value is not None and value in self.exact:
+                return self.exact[value]
+        for pattern, result in self.patterns:
+            for value in values:
+                if value is not None and pattern.search(value):
+                    return result
+        return None
+
+
+class OpacityRules:
+    """The full and partial opacity tables compiled into one lookup.
+
+    Precedence: full opacity by any property, then partial opacity by name,
+    class, role and type. Everything but the name is stable for a window, so
+    that part of the lookup is cached per (class, class, role, type).
+    """
+
+    def __init__(self, full: dict[str, Any], partial: dict[str, dict[Any, float]]) -> None:
+        full_spec = {field: FieldRules(dict.fromkeys(keys, FULL_OPACITY)) for field, keys in full.items()}
+        partial_spec = {
+            field: FieldRules({k: OpacitySpec(False, v) for k, v in values.items()})
+            for field, values in partial.items()
+        }
+        self.full_name = full_spec["name"]
+        self.full_role = full_spec["role"]
+        self.partial_name = partial_spec["name"]
+        # rules applied to the (class, class, role, type) key, by index into it
+        self.by_class = [
+            (full_spec["role"], (2,)),
+            (full_spec["type"], (3,)),
+            (full_spec["class"], (0, 1)),
+            (partial_spec["class"], (0, 1)),
+            (partial_spec["role"], (2,)),
+            (partial_spec["type"], (3,)),
+        ]
+        self.lookup_class = functools.lru_cache(maxsize=512)(self._lookup_class)
+
+    def is_full(self, name: Optional[str], role: Optional[str]) -> bool:
+        return self.full_name.get(name) is not None or self.full_role.get(role) is not None
+
+    def _lookup_class(self, *key: Optional[str]) -> OpacitySpec:
+        for field_rules, indices in self.by_class:
+            if (spec := field_rules.get(*(key[i] for i in indices))) is not None:
+                return spec
+        return DEFAULT_OPACITY
+
+    def lookup(
+        self,
+        cls0: Optional[str],
+        cls1: Optional[str],
+        name: Optional[str],
+        role: Optional[str],
+        type: Optional[str],
+    ) -> OpacitySpec:
+        if name is not None and self.full_name.get(name) is not None:
+            return FULL_OPACITY
+        spec = self.lookup_class(cls0, cls1, role, type)
+        if spec.full or name is None:
+            return spec
+        return self.partial_name.get(name) or spec
+
+
+def load_rules() -> tuple[dict[str, Any], dict[str, dict[Any, float]]]:
+    full = {field: set(keys) for field, keys in full_opacities.items()}
+    partial = {field: dict(values) for field, values in partial_opacities.items()}
+    try:
+        with OPACITY_RULES_FILE.open() as f:
+            overrides = json.load(f)
+    except FileNotFoundError:
+        overrides = {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"ignoring opacity rules in {OPACITY_RULES_FILE}: {e}")
+        overrides = {}
+    for field, keys in overrides.get("full", {}).items():
+        full.setdefault(field, set()).update(keys)
+    for field, values in overrides.get("partial", {}).items():
+        partial.setdefault(field, {}).update(values)
+    return full, partial
+
+
+rules = OpacityRules(*load_rules())
+
+
+@on_reload
+def reload_rules() -> None:
+    global rules
+    rules = OpacityRules(*load_rules())
+
+
+# picom condition targets of the rule fields, the class matches instance or general class
+PICOM_TARGETS = {
+    "class": ("class_i", "class_g"),
+    "name": ("name",),
+    "role": ("role",),
+    "type": ("window_type",),
+}
+# kept over config reloads, so only actual changes of the option clear or restore the opacities
+_picom_dimming: bool = globals().get("_picom_dimming", False)
+
+
+def _picom_condition(field: str, key: Any) -> str:
+    if isinstance(key, re.Pattern):
+        op, value = "~=", key.pattern
+    elif key.startswith(REGEX_PREFIX):
+        op, value = "~=", key[len(REGEX_PREFIX):]
+    else:
+        op, value = "=", key
+    value = value.replace("\\", "\\\\").replace("'", "\\'")
+    conditions = [f"{target} ?{op} '{value}'" for target in PICOM_TARGETS[field]]
+    condition = " || ".join(conditions)
+    # the rules end up in double quoted libconfig strings
+    condition = condition.replace("\\", "\\\\").replace('"', '\\"')
+    return f"({condition})" if len(conditions) > 1 else condition
 
-    return *classes, name, role, type
 
+def picom_opacity_rules() -> list[str]:
+    """Translate the opacity tables into picom opacity-rule entries, in order of precedence."""
+    full, partial = load_rules()
+    entries = []
+    for field in ("name", "role", "type", "class"):
+        # sets are sorted, so the output does not change between runs
+        keys = sorted(full.get(field, ()), key=str)
+        entries.extend(f"100:{_picom_condition(field, key)}" for key in keys)
+    for field in ("name", "class", "role", "type"):
+        for key, value in partial.get(field, {}).items():
+            condition = _picom_condition(field, key)
+            entries.append(f"{round(value * 100)}:focused && {condition}")
+            entries.append(f"{round(value * DIM_FACTOR * 100)}:!focused && {condition}")
+    return entries
 
-def get_opacity_spec(window: Window, cls=None, name=None, role=None, type=None):
+
+def picom_dimming_enabled() -> bool:
+    return os.environ.get(PICOM_DIMMING_KEY, "off") == "on"
+
+
+def picom_variables() -> dict[str, Any]:
+    if not picom_dimming_enabled():
+        return {"picom_dimming": False}
+    return {
+        "picom_dimming": True,
+        "inactive_opacity": DIM_FACTOR,
+        "opacity_rules": picom_opacity_rules(),
+    }
+
+
+def is_picom_running() -> bool:
+    import psutil
+
+    return any(p.info["name"] == "picom" for p in psutil.process_iter(["name"]))
+
+
+@subscribe.startup_complete
+@on_reload
+def update_picom_dimming() -> None:
+    """Check whether picom dims the inactive windows, otherwise it is done here."""
+    global _picom_dimming
+    enabled = picom_dimming_enabled() and is_picom_running()
+    if enabled == _picom_dimming:
+        return
+    _picom_dimming = enabled
+    from libqtile import qtile
+
+    if enabled:
+        # with inactive-opacity-override off, opacities written before would win over picom's
+        writer.clear(qtile)
+    else:
+        reapply_opacities(qtile)
+
+
+class OpacityOverrides:
+    """Per class opacities learned from the step_opacity bindings, persisted across restarts."""
+
+    def __init__(self, path: Path = OPACITY_OVERRIDES_FILE) -> None:
+        self.path = path
+        self.values: dict[str, OpacitySpec] = self.load()
+        self.save_handle: Optional[asyncio.TimerHandle] = None
+
+    def load(self) -> dict[str, OpacitySpec]:
+        try:
+            with self.path.open() as f:
+                values = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring opacity overrides in {self.path}: {e}")
+            return {}
+        specs = {}
+        for cls, value in values.items():
+            # plain numbers are dimmable opacities
+            if isinstance(value, (int, float)):
+                specs[cls] = OpacitySpec(False, float(value))
+            elif isinstance(value, dict) and isinstance(value.get("value"), (int, float)):
+                specs[cls] = OpacitySpec(not value.get("dimmable", True), float(value["value"]))
+        return specs
+
+    def get(self, cls0: Optional[str], cls1: Optional[str]) -> Optional[OpacitySpec]:
+        if not self.values:
+            return None
+        return self.values.get(cls1) if cls1 in self.values else self.values.get(cls0)
+
+    def set(self, cls: str, spec: OpacitySpec) -> None:
+        self.values[cls] = spec
+        # key repeat would otherwise write the file for every step
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+        try:
+            self.save_handle = asyncio.get_running_loop().call_later(SAVE_DELAY, self.save)
+        except RuntimeError:
+            self.save()
+
+    def save(self) -> None:
+        self.save_handle = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            values = {cls: {"value": spec.value, "dimmable": not spec.full} for cls, spec in self.values.items()}
+            self.path.write_text(json.dumps(values, indent=2, sort_keys=True))
+        except OSError as e:
+            logger.warning(f"cannot save opacity overrides to {self.path}: {e}")
+
+
+overrides = OpacityOverrides()
+
+
+def get_specs(window: Window):
+    return tuple(window_props(window))
+
+
+def get_opacity_spec(window: Window, cls=None, name=None, role=None, type=None) -> OpacitySpec:
     if cls or name or role or type:
         cls0, cls1 = ("", cls) if cls else (None, None)
     else:
         cls0, cls1, name, role, type = get_specs(window)
-
-    try:
-        has_full_opacity = (
-            name in full_opacities["name"]
-            or role in full_opacities["role"]
-            or type in full_opacities["type"]
-            or cls0 in full_opacities["class"]
-            or cls1 in full_opacities["class"]
-        )
-        if has_full_opacity:
-            return {"full": True, "value": 1.0}
-    except IndexError as e:
-        logger.warn(e)
-        return {"full": True, "value": 1.0}
-
-    opacity = partial_opacities["name"].get(name)
-    if opacity is None:
-        c = partial_opacities["class"]
-        opacity = c.get(cls0, c.get(cls1))
-        if opacity is None:
-            opacity = partial_opacities["role"].get(role)
-            if opacity is None:
-                opacity = partial_opacities["type"].get(type)
-    return {"full": False, "value": opacity if opacity is not None else 1.0}
+    if rules.is_full(name, role):
+        return FULL_OPACITY
+    if (spec := overrides.get(cls0, cls1)) is not None:
+        return spec
+    return rules.lookup(cls0, cls1, name, role, type)
 
 
 def has_full_opacity(window: Window):
-    return get_opacity_spec(window)["full"]
+    return get_opacity_spec(window).full
 
 
-@hook.subscribe.client_new
-def add_opacity(window: Window):
-    opacity_spec = get_opacity_spec(window)
-    if opacity_spec["full"]:
+@window_rules.stage("opacity")
+def add_opacity(window: Window, value: Any = None):
+    if _picom_dimming:
+        return
+    if value is None:
+        opacity_spec = get_opacity_spec(window)
+    else:
+        opacity_spec = FULL_OPACITY if value == "full" else OpacitySpec(False, value)
+    if opacity_spec.full:
+        if opacity_spec.value < 1.0:
+            writer.set(window, opacity_spec.value)
         set_opacities(window, dim=False)
         return
 
-    opacity = opacity_spec["value"]
+    opacity = opacity_spec.value
     if opacity:
-        window.opacity = opacity
+        writer.set(window, opacity)
     set_opacities(window)
 
 
-@hook.subscribe.client_focus
+@subscribe.client_focus
 def reset_opacity(window: Window):
-    global previous_window
+    global _previous_window
 
+    if _picom_dimming:
+        return
+    previous_window = _previous_window() if _previous_window is not None else None
     if window is previous_window:
         return
 
     try:
-        window.opacity = window._full_opacity
+        writer.set(window, window._full_opacity)
     except AttributeError:
         set_opacities(window)
 
-    if previous_window:
+    if previous_window is not None:
         try:
-            previous_window.opacity = previous_window._dimmed_opacity
+            writer.set(previous_window, previous_window._dimmed_opacity)
         except AttributeError:
             set_opacities(previous_window)
-            previous_window.opacity = previous_window._dimmed_opacity
-    previous_window = window
+            writer.set(previous_window, previous_window._dimmed_opacity)
+    _previous_window = weakref.ref(window)
 
 
-@hook.subscribe.client_name_updated
+@subscribe.client_name_updated
 def make_calendar_opacque(window: Window):
-    if (w := window.window.get_wm_class()) and w[1] != "thunderbird":
+    if _picom_dimming:
+        return
+    if get_class_key(window)[1] != "thunderbird":
         return
     op = get_opacity_spec(window)
-    window.opacity = op["value"]
-    set_opacities(window, dim=not op["full"], overwrite=True)
+    writer.set(window, op.value)
+    set_opacities(window, dim=not op.full, overwrite=True)
+
+
+def reapply_opacities(qtile: Any) -> None:
+    """Compute and write the opacities of all client windows again, dimming all but the focused one."""
+    global _previous_window
+
+    current = qtile.current_window
+    for window in list(qtile.windows_map.values()):
+        if not isinstance(window, Window):
+            continue
+        for attr in ("_full_opacity", "_dimmed_opacity", "_dimmable"):
+            window.__dict__.pop(attr, None)
+        add_opacity(window, window_rules.get_rules().resolve(window_props(window)).get("opacity"))
+        if window is not current:
+            writer.set(window, window._dimmed_opacity)
+    _previous_window = weakref.ref(current) if current is not None else None
+
+
+def step_opacity(qtile: Any, delta: float = OPACITY_STEP) -> None:
+    """Change the opacity of the focused window and remember it for its class."""
+    window = qtile.current_window
+    if window is None:
+        return
+    value = round(min(max(writer.get(window) + delta, MIN_OPACITY), 1.0), 3)
+    writer.set(window, value)
+    dimmable = getattr(window, "_dimmable", True)
+    window._full_opacity = value
+    window._dimmed_opacity = value * DIM_FACTOR if dimmable else value
+    if (cls := get_class_key(window)[1]) is not None:
+        overrides.set(cls, OpacitySpec(not dimmable, value))
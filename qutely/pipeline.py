@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Generator, Iterable, Optional, Union
+
+from libqtile.log_utils import logger
+
+
+PhaseFn = Callable[[], Union[Awaitable[Any], Any]]
+
+
+class PhaseState:
+    PENDING = "pending"
+    OK = "ok"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+
+@dataclass
+class Phase:
+    name: str
+    fn: PhaseFn
+    deps: tuple[str, ...] = ()
+
+
+@dataclass
+class PhaseResult:
+    name: str
+    state: str = PhaseState.PENDING
+    wall: float = 0.0
+    cpu: float = 0.0
+    error: Optional[BaseException] = None
+
+    def __str__(self) -> str:
+        msg = f"{self.name:<16} {self.state:<8} wall={self.wall * 1000:8.1f}ms cpu={self.cpu * 1000:8.1f}ms"
+        if self.error is not None:
+            msg += f" error={self.error!r}"
+        return msg
+
+
+@dataclass
+class PipelineReport:
+    name: str
+    results: dict[str, PhaseResult] = field(default_factory=dict)
+    wall: float = 0.0
+    cpu: float = 0.0
+
+    @property
+    def failed(self) -> list[PhaseResult]:
+        return [r for r in self.results.values() if r.state != PhaseState.OK]
+
+    def __str__(self) -> str:
+        lines = [
+            f"pipeline {self.name!r} finished in wall={self.wall * 1000:.1f}ms cpu={self.cpu * 1000:.1f}ms"
+        ]
+        ordered = sorted(self.results.values(), key=lambda r: r.wall, reverse=True)
+        lines.extend(f"  {r}" for r in ordered)
+        return "\n".join(lines)
+
+
+class StepTimed:
+    """Drive a coroutine step by step and sum up the time spent inside each step.
+
+    Concurrent coroutines share the event loop thread, so measuring around the whole
+    await would attribute the work of everything else running on the loop to it as well.
+    ``busy`` is the wall time the coroutine blocked the loop, ``cpu`` its thread cpu time.
+    """
+
+    def __init__(
+        self,
+        coro: Awaitable[Any],
+        on_enter: Optional[Callable[[], None]] = None,
+        on_leave: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.coro = coro.__await__()
+        self.cpu = 0.0
+        self.busy = 0.0
+        self.on_enter = on_enter
+        self.on_leave = on_leave
+
+    def _leave(self, start: float, cpu_start: float) -> None:
+        self.busy += time.perf_counter() - start
+        self.cpu += time.thread_time() - cpu_start
+        if self.on_leave:
+            self.on_leave()
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        value: Any = None
+        exc: Optional[BaseException] = None
+        while True:
+            if self.on_enter:
+                self.on_enter()
+            start = time.perf_counter()
+            cpu_start = time.thread_time()
+            try:
+                if exc is not None:
+                    future = self.coro.throw(exc)
+                else:
+                    future = self.coro.send(value)
+            except StopIteration as e:
+                self._leave(start, cpu_start)
+                return e.value
+            except BaseException:
+                self._leave(start, cpu_start)
+                raise
+            self._leave(start, cpu_start)
+            exc = None
+            try:
+                value = yield future
+            except BaseException as e:
+                exc = e
+
+
+class Pipeline:
+    def __init__(self, name: str, phases: Iterable[Phase] = ()) -> None:
+        self.name = name
+        self.phases: dict[str, Phase] = {}
+        self.last_report: Optional[PipelineReport] = None
+        for phase in phases:
+            self.add(phase)
+
+    def add(self, phase: Phase) -> None:
+        if phase.name in self.phases:
+            raise ValueError(f"duplicate phase {phase.name!r} in pipeline {self.name!r}")
+        self.phases[phase.name] = phase
+
+    def phase(self, name: str, *deps: str) -> Callable[[PhaseFn], PhaseFn]:
+        def decorator(fn: PhaseFn) -> PhaseFn:
+            self.add(Phase(name, fn, deps))
+            return fn
+
+        return decorator
+
+    def validate(self) -> None:
+        for phase in self.phases.values():
+            for dep in phase.deps:
+                if dep not in self.phases:
+                    raise ValueError(f"phase {phase.name!r} depends on unknown phase {dep!r}")
+        visited: set[str] = set()
+        in_progress: set[str] = set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in in_progress:
+                raise ValueError(f"dependency cycle in pipeline {self.name!r} at phase {name!r}")
+            in_progress.add(name)
+            for dep in self.phases[name].deps:
+                visit(dep)
+            in_progress.remove(name)
+            visited.add(name)
+
+        for name in self.phases:
+            visit(name)
+
+    async def _run_phase(
+        self, phase: Phase, tasks: dict[str, asyncio.Task[None]], report: PipelineReport
+    ) -> None:
+        result = report.results[phase.name]
+        if phase.deps:
+            await asyncio.gather(*(tasks[dep] for dep in phase.deps))
+        if failed := [dep for dep in phase.deps if report.results[dep].state != PhaseState.OK]:
+            result.state = PhaseState.SKIPPED
+            logger.warning(f"skipping phase {phase.name!r}: dependencies {failed} did not succeed")
+            return
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        cpu_start = time.thread_time()
+        try:
+            res = phase.fn()
+            result.cpu = time.thread_time() - cpu_start
+            if asyncio.iscoroutine(res) or isinstance(res, asyncio.Future):
+                timed = StepTimed(res)
+                try:
+                    await timed
+                finally:
+                    result.cpu += timed.cpu
+            result.state = PhaseState.OK
+        except Exception as e:
+            result.state = PhaseState.FAILED
+            result.error = e
+            logger.error(f"phase {phase.name!r} of pipeline {self.name!r} failed: {e}", exc_info=True)
+        finally:
+            result.wall = loop.time() - start
+
+    async def run(self) -> PipelineReport:
+        self.validate()
+        loop = asyncio.get_running_loop()
+        report = PipelineReport(self.name)
+        report.results = {name: PhaseResult(name) for name in self.phases}
+        start = loop.time()
+        cpu_start = time.process_time()
+        tasks: dict[str, asyncio.Task[None]] = {}
+        for phase in self.phases.values():
+            tasks[phase.name] = loop.create_task(self._run_phase(phase, tasks, report))
+        await asyncio.gather(*tasks.values())
+        report.wall = loop.time() - start
+        report.cpu = time.process_time() - cpu_start
+        self.last_report = report
+        # at warning level, qtile's default log level hides info
+        logger.warning(str(report))
+        return report
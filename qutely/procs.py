@@ -618,7 +618,6 @@ class LegacySyncProc:
 
 
 _feh = LegacySyncProc("feh", "--bg-fill", default_arg=os.path.expanduser("~/.wallpaper"))
-_setxkbmap = LegacySyncProc("setxkbmap", default_args=("de", "deadacute"), shell=True)
 _unclutter = LegacySyncProc("unclutter", "-root", "-idle", default_arg="3", bg=True)
 _polkit_agent = LegacySyncProc(
     "/usr/lib/policykit-1-gnome/polkit-gnome-authentication-agent-1", bg=True
@@ -677,19 +676,11 @@ bluetooth = Proc("blueman-applet", bg=True)
 onedrive_gui = Proc("onedrive-gui", bg=True)
 nextcloud_sync = Proc("nextcloud", bg=True)
 kde_connect = Proc("kdeconnect-indicator", bg=True)
-setxkbmap = Proc("setxkbmap", "de", "deadacute", shell=True)
 fakecam = Proc("fakecam", "start")
 pulseaudio = Proc("pulseaudio", "-D")
 light = Proc("light")
 neochat = Proc("neochat")
 opensnitch = Proc("opensnitch-ui", bg=True)
-activate_touchpad = Proc(
-    "xinput",
-    "set-prop",
-    "SynPS/2 Synaptics TouchPad",
-    "libinput Tapping Enabled",
-    "1",
-)
 kitty = Proc("kitty")
 start_custom_session = Proc("systemctl", "--user", "--no-block", "start", "custom-session.target")
 
@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import sys
+import json
+import time
+import asyncio
+import functools
+import threading
+import traceback
+from bisect import bisect_left
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+from contextlib import contextmanager
+
+from libqtile import hook
+from libqtile.log_utils import logger
+
+from qutely.debug import profile_hooks
+from qutely.pipeline import StepTimed
+
+
+CACHE_DIR = Path("~/.cache/qtile").expanduser()
+HOOK_STATS_FILE = CACHE_DIR / "hook-stats.json"
+KEY_STATS_FILE = CACHE_DIR / "key-stats.json"
+SLOW_CALL_THRESHOLD = 0.02
+DUMP_INTERVAL = 60
+MAX_SAMPLES = 2048
+MAX_STACKS = 5
+# upper bounds in milliseconds of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class LatencyStats:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: deque[float] = deque(maxlen=MAX_SAMPLES)
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.stacks: deque[tuple[float, str]] = deque(maxlen=MAX_STACKS)
+
+    def record(self, duration: float, failed: bool = False) -> None:
+        self.calls += 1
+        self.errors += failed
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.samples.append(duration)
+        self.histogram[bisect_left(HISTOGRAM_BUCKETS, duration * 1000)] += 1
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    @property
+    def p99(self) -> float:
+        return self.percentile(0.99)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+    def as_dict(self, with_stacks: bool = True) -> dict[str, Any]:
+        d: dict[str, Any] = {
+            "name": self.name,
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.mean * 1000, 3),
+            "p99_ms": round(self.p99 * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "histogram": {
+                f"<={b}ms" if i < len(HISTOGRAM_BUCKETS) else f">{HISTOGRAM_BUCKETS[-1]}ms": n
+                for i, (b, n) in enumerate(zip((*HISTOGRAM_BUCKETS, None), self.histogram))
+                if n
+            },
+        }
+        if with_stacks:
+            d["slow_stacks"] = [
+                {"elapsed_ms": round(elapsed * 1000, 3), "stack": stack}
+                for elapsed, stack in self.stacks
+            ]
+        return d
+
+
+class StatsRegistry:
+    def __init__(self, name: str, dump_file: Path) -> None:
+        self.name = name
+        self.dump_file = dump_file
+        self.stats: dict[str, LatencyStats] = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str) -> LatencyStats:
+        with self.lock:
+            if (stats := self.stats.get(name)) is None:
+                stats = self.stats[name] = LatencyStats(name)
+            return stats
+
+    def record(self, name: str, duration: float, failed: bool = False) -> None:
+        stats = self.get(name)
+        with self.lock:
+            stats.record(duration, failed)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stats.clear()
+
+    def report(self, top: int = 0, sort: str = "p99_ms", with_stacks: bool = True) -> list[dict[str, Any]]:
+        with self.lock:
+            entries = [s.as_dict(with_stacks) for s in self.stats.values()]
+        entries.sort(key=lambda d: d.get(sort, 0), reverse=True)
+        return entries[:top] if top else entries
+
+    def dump(self) -> Path:
+        self.dump_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.dump_file.with_suffix(".tmp")
+        with tmp_file.open("w") as f:
+            json.dump({"time": time.time(), self.name: self.report()}, f, indent=2)
+        tmp_file.replace(self.dump_file)
+        return self.dump_file
+
+
+class StackSampler(threading.Thread):
+    """Background thread taking stack samples of calls that exceed the slow-call threshold.
+
+    A stack taken after a slow call has returned only shows the caller, so the sampler
+    grabs the stack of the main thread while the slow call is still running.
+    """
+
+    def __init__(self, threshold: float = SLOW_CALL_THRESHOLD, dump_interval: float = DUMP_INTERVAL) -> None:
+        super().__init__(name="qutely-stack-sampler", daemon=True)
+        self.threshold = threshold
+        self.dump_interval = dump_interval
+        self.registries: list[StatsRegistry] = []
+        # per thread: stack of [stats, start, already sampled]
+        self.active: dict[int, list[list[Any]]] = {}
+
+    @contextmanager
+    def track(self, stats: LatencyStats) -> Iterator[None]:
+        calls = self.active.setdefault(threading.get_ident(), [])
+        calls.append([stats, time.perf_counter(), False])
+        try:
+            yield
+        finally:
+            calls.pop()
+
+    def enter(self, stats: LatencyStats) -> None:
+        self.active.setdefault(threading.get_ident(), []).append([stats, time.perf_counter(), False])
+
+    def leave(self) -> None:
+        self.active[threading.get_ident()].pop()
+
+    def sample(self) -> None:
+        now = time.perf_counter()
+        frames = None
+        for tid, calls in list(self.active.items()):
+            if not calls:
+                continue
+            entry = calls[-1]
+            stats, start, sampled = entry
+            if sampled or now - start < self.threshold:
+                continue
+            if frames is None:
+                frames = sys._current_frames()
+            if (frame := frames.get(tid)) is None:
+                continue
+            entry[2] = True
+            stats.stacks.append((now - start, "".join(traceback.format_stack(frame))))
+
+    def run(self) -> None:
+        last_dump = time.monotonic()
+        while True:
+            time.sleep(self.threshold / 2)
+            try:
+                self.sample()
+                if time.monotonic() - last_dump > self.dump_interval:
+                    last_dump = time.monotonic()
+                    for registry in self.registries:
+                        registry.dump()
+            except Exception as e:
+                logger.warning(f"stack sampler failed: {e}")
+
+
+# config reloads re-execute this module, the sampler thread and its registries are kept
+hook_stats: StatsRegistry = globals().get("hook_stats") or StatsRegistry("hooks", HOOK_STATS_FILE)
+key_stats: StatsRegistry = globals().get("key_stats") or StatsRegistry("keys", KEY_STATS_FILE)
+_sampler: Optional[StackSampler] = globals().get("_sampler")
+
+
+def get_sampler() -> StackSampler:
+    global _sampler
+    if _sampler is None:
+        _sampler = StackSampler()
+        _sampler.start()
+    return _sampler
+
+
+def profiled(name: str, func: Callable[..., Any], registry: StatsRegistry = hook_stats) -> Callable[..., Any]:
+    sampler = get_sampler()
+    if registry not in sampler.registries:
+        sampler.registries.append(registry)
+    stats = registry.get(name)
+
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            # only the time spent in the handler blocks the loop, awaiting does not
+            timed = StepTimed(func(*args, **kwargs), lambda: sampler.enter(stats), sampler.leave)
+            failed = True
+            try:
+                res = await timed
+                failed = False
+                return res
+            finally:
+                registry.record(name, timed.busy, failed)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        failed = True
+        start = time.perf_counter()
+        try:
+            with sampler.track(stats):
+                res = func(*args, **kwargs)
+            failed = False
+            return res
+        finally:
+            registry.record(name, time.perf_counter() - start, failed)
+
+    return wrapper
+
+
+def handler_name(hook_name: str, func: Callable[..., Any]) -> str:
+    return f"{hook_name}:{func.__module__}.{func.__qualname__}"
+
+
+class ProfilingSubscribe:
+    """Drop-in for ``hook.subscribe`` that registers profiled wrappers of the handlers.
+
+    The decorators return the undecorated function, so handlers can still be called
+    directly without showing up in the statistics.
+    """
+
+    def user(self, hook_name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        register = hook.subscribe.user(hook_name)
+
+        def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+            register(profiled(handler_name(f"user:{hook_name}", func), func))
+            return func
+
+        return decorator
+
+    def __getattr__(self, hook_name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        register = getattr(hook.subscribe, hook_name)
+
+        def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+            register(profiled(handler_name(hook_name, func), func))
+            return func
+
+        return decorator
+
+
+subscribe: Any = ProfilingSubscribe() if profile_hooks else hook.subscribe
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+from typing import Any, Callable, NamedTuple, Optional
+
+import hashlib
+
+import xcffib
+import xcffib.randr
+from xcffib.randr import Connection as OutputConnection, NotifyMask, Rotation
+
+from qutely.xconn import (
+    EventWatcher,
+    get_connection,
+    get_extension,
+    get_root,
+    intern_atom,
+    to_bytes,
+    to_str,
+)
+from qutely.display import OutputLayout, PhysicalScreen, VirtualScreen, make_virtual_screen
+
+
+RANDR_VERSION = (1, 5)
+
+ROTATIONS = {
+    Rotation.Rotate_0: "normal",
+    Rotation.Rotate_90: "left",
+    Rotation.Rotate_180: "inverted",
+    Rotation.Rotate_270: "right",
+}
+
+
+ROTATION_FLAGS = {name: flag for flag, name in ROTATIONS.items()}
+DPI = 96
+EDID_LENGTH = 256
+
+
+class OutputState(NamedTuple):
+    id: int
+    name: str
+    connected: bool
+    crtc: int
+    crtcs: list[int]
+    modes: list[int]
+    preferred: list[int]
+    mm_width: int
+    mm_height: int
+    edid_hash: str
+
+
+def get_randr(conn: xcffib.Connection) -> Any:
+    return get_extension(conn, xcffib.randr, *RANDR_VERSION)
+
+
+def rotation_name(rotation: int) -> str:
+    return ROTATIONS.get(rotation & 0xF, "normal")
+
+
+def reflection_name(rotation: int) -> str:
+    x = rotation & Rotation.Reflect_X
+    y = rotation & Rotation.Reflect_Y
+    if x and y:
+        return "X and Y axis"
+    elif x:
+        return "X axis"
+    elif y:
+        return "Y axis"
+    return "normal"
+
+
+def _physical_screen(name: str, info: Any, crtc: Any, is_primary: bool) -> PhysicalScreen:
+    is_used = crtc is not None and crtc.width > 0
+    rotation = crtc.rotation if is_used else Rotation.Rotate_0
+    return PhysicalScreen(
+        name=name,
+        is_connected=info.connection == OutputConnection.Connected,
+        is_primary=is_primary,
+        rotation=rotation_name(rotation),
+        reflection=reflection_name(rotation),
+        width=crtc.width if is_used else 0,
+        height=crtc.height if is_used else 0,
+        mm_width=info.mm_width,
+        mm_height=info.mm_height,
+        xoffset=crtc.x if is_used else 0,
+        yoffset=crtc.y if is_used else 0,
+        is_used=is_used,
+    )
+
+
+def query_screens(conn: Optional[xcffib.Connection] = None) -> VirtualScreen:
+    conn = conn or get_connection()
+    randr = get_randr(conn)
+    root = get_root(conn)
+
+    # requests are pipelined: the cookies are collected first and only then are the
+    # replies awaited, so the whole layout takes two round trips, however many outputs
+    resources_cookie = randr.GetScreenResourcesCurrent(root)
+    geometry_cookie = conn.core.GetGeometry(root)
+    primary_cookie = randr.GetOutputPrimary(root)
+    size_range_cookie = randr.GetScreenSizeRange(root)
+    resources = resources_cookie.reply()
+    ts = resources.config_timestamp
+    output_cookies = [randr.GetOutputInfo(output, ts) for output in resources.outputs]
+    crtc_cookies = {crtc: randr.GetCrtcInfo(crtc, ts) for crtc in resources.crtcs}
+
+    primary = primary_cookie.reply().output
+    size_range = size_range_cookie.reply()
+    crtcs = {crtc: cookie.reply() for crtc, cookie in crtc_cookies.items()}
+    screens = []
+    for output, cookie in zip(resources.outputs, output_cookies):
+        info = cookie.reply()
+        crtc = crtcs.get(info.crtc) if info.crtc else None
+        screens.append(_physical_screen(to_str(info.name), info, crtc, output == primary))
+
+    geometry = geometry_cookie.reply()
+    return make_virtual_screen(
+        screens,
+        width=geometry.width,
+        height=geometry.height,
+        min_width=size_range.min_width,
+        max_width=size_range.max_width,
+        min_height=size_range.min_height,
+        max_height=size_range.max_height,
+    )
+
+
+def _select_screen_changes(conn: xcffib.Connection) -> None:
+    mask = NotifyMask.ScreenChange | NotifyMask.OutputChange | NotifyMask.CrtcChange
+    get_randr(conn).SelectInput(get_root(conn), mask)
+
+
+def watch_screen_changes(callback: Callable[[Any], None]) -> EventWatcher:
+    def on_event(event: Any) -> None:
+        if isinstance(event, (xcffib.randr.ScreenChangeNotifyEvent, xcffib.randr.NotifyEvent)):
+            callback(event)
+
+    watcher = EventWatcher(_select_screen_changes, on_event)
+    watcher.start()
+    return watcher
+
+
+def mode_rate(mode: Any) -> float:
+    if not mode.htotal or not mode.vtotal:
+        return 0.0
+    return mode.dot_clock / (mode.htotal * mode.vtotal)
+
+
+def query_outputs(conn: Optional[xcffib.Connection] = None) -> tuple[Any, dict[str, OutputState]]:
+    conn = conn or get_connection()
+    randr = get_randr(conn)
+    resources = randr.GetScreenResourcesCurrent(get_root(conn)).reply()
+    ts = resources.config_timestamp
+    edid_atom = intern_atom(conn, "EDID")
+    info_cookies = [randr.GetOutputInfo(output, ts) for output in resources.outputs]
+    edid_cookies = [
+        randr.GetOutputProperty(
+            output, edid_atom, xcffib.xproto.GetPropertyType.Any, 0, EDID_LENGTH // 4, False, False
+        )
+        for output in resources.outputs
+    ]
+    outputs = {}
+    for output, info_cookie, edid_cookie in zip(resources.outputs, info_cookies, edid_cookies):
+        info = info_cookie.reply()
+        edid = to_bytes(edid_cookie.reply().data)
+        name = to_str(info.name)
+        outputs[name] = OutputState(
+            id=output,
+            name=name,
+            connected=info.connection == OutputConnection.Connected,
+            crtc=info.crtc,
+            crtcs=list(info.crtcs),
+            modes=list(info.modes),
+            preferred=list(info.modes)[: info.num_preferred],
+            mm_width=info.mm_width,
+            mm_height=info.mm_height,
+            edid_hash=hashlib.sha1(edid).hexdigest() if edid else "",
+        )
+    return resources, outputs
+
+
+class CrtcTarget(NamedTuple):
+    crtc: int
+    x: int
+    y: int
+    mode: int
+    rotation: int
+    output: int
+
+    def matches(self, info: Any) -> bool:
+        return (info.x, info.y, info.mode, info.rotation, list(info.outputs)) == (
+            self.x,
+            self.y,
+            self.mode,
+            self.rotation,
+            [self.output],
+        )
+
+
+def _check_status(reply: Any, crtc: int) -> int:
+    if reply.status != xcffib.randr.SetConfig.Success:
+        raise ValueError(f"could not configure crtc {crtc}: status={reply.status}")
+    return reply.timestamp
+
+
+def _find_mode(resources: Any, output: OutputState, width: int, height: int, rate: float) -> Any:
+    candidates = [
+        m for m in resources.modes if m.id in output.modes and (m.width, m.height) == (width, height)
+    ]
+    if not candidates:
+        raise ValueError(f"output {output.name} does not support a mode of {width}x{height}")
+    if rate:
+        return min(candidates, key=lambda m: abs(mode_rate(m) - rate))
+    if preferred := [m for m in candidates if m.id in output.preferred]:
+        return preferred[0]
+    return max(candidates, key=mode_rate)
+
+
+def apply_layout(
+    layout: dict[str, OutputLayout], conn: Optional[xcffib.Connection] = None
+) -> tuple[int, int]:
+    """Configure the outputs in ``layout`` and disable all others.
+
+    Returns the (timestamp, config timestamp) of the new configuration, which is
+    also reported by the randr events caused by it.
+    """
+    conn = conn or get_connection()
+    randr = get_randr(conn)
+    root = get_root(conn)
+    resources, outputs = query_outputs(conn)
+    ts = resources.config_timestamp
+    crtc_cookies = {crtc: randr.GetCrtcInfo(crtc, ts) for crtc in resources.crtcs}
+    crtcs = {crtc: cookie.reply() for crtc, cookie in crtc_cookies.items()}
+
+    if unknown := [name for name in layout if name not in outputs or not outputs[name].connected]:
+        raise ValueError(f"outputs not connected: {', '.join(unknown)}")
+
+    targets: list[CrtcTarget] = []
+    taken: set[int] = set()
+    for name, out in layout.items():
+        output = outputs[name]
+        rotation = ROTATION_FLAGS[out.rotation]
+        rotated = rotation in (Rotation.Rotate_90, Rotation.Rotate_270)
+        mode_width, mode_height = (out.height, out.width) if rotated else (out.width, out.height)
+        mode = _find_mode(resources, output, mode_width, mode_height, out.rate)
+        if output.crtc and output.crtc in output.crtcs and output.crtc not in taken:
+            crtc = output.crtc
+        else:
+            free = [c for c in output.crtcs if c not in taken and not crtcs[c].outputs]
+            if not free:
+                raise ValueError(f"no free crtc for output {name}")
+            crtc = free[0]
+        taken.add(crtc)
+        targets.append(CrtcTarget(crtc, out.x, out.y, mode.id, rotation, output.id))
+
+    width = max(out.x + out.width for out in layout.values())
+    height = max(out.y + out.height for out in layout.values())
+    unchanged = {t.crtc for t in targets if t.matches(crtcs[t.crtc])}
+
+    timestamp = config_timestamp = ts
+    conn.core.GrabServer()
+    try:
+        # crtcs that change or would not fit into the new screen size must be
+        # disabled before the screen is resized
+        for crtc, info in crtcs.items():
+            if not info.mode or crtc in unchanged:
+                continue
+            reply = randr.SetCrtcConfig(crtc, 0, ts, 0, 0, 0, Rotation.Rotate_0, 0, []).reply()
+            timestamp = max(timestamp, _check_status(reply, crtc))
+        mm_width = round(width * 25.4 / DPI)
+        mm_height = round(height * 25.4 / DPI)
+        randr.SetScreenSize(root, width, height, mm_width, mm_height)
+        for t in targets:
+            if t.crtc in unchanged:
+                continue
+            reply = randr.SetCrtcConfig(
+                t.crtc, 0, ts, t.x, t.y, t.mode, t.rotation, 1, [t.output]
+            ).reply()
+            timestamp = max(timestamp, _check_status(reply, t.crtc))
+        primary = [outputs[name].id for name, out in layout.items() if out.primary]
+        randr.SetOutputPrimary(root, primary[0] if primary else 0)
+    finally:
+        conn.core.UngrabServer()
+        conn.flush()
+    return timestamp, config_timestamp
+
+
+def event_timestamps(event: Any) -> tuple[int, int]:
+    if isinstance(event, xcffib.randr.ScreenChangeNotifyEvent):
+        return event.timestamp, event.config_timestamp
+    if event.subCode == xcffib.randr.Notify.OutputChange:
+        return event.u.oc.timestamp, event.u.oc.config_timestamp
+    if event.subCode == xcffib.randr.Notify.CrtcChange:
+        return event.u.cc.timestamp, 0
+    return 0, 0
+
+
+def is_output_change(event: Any) -> bool:
+    return (
+        isinstance(event, xcffib.randr.NotifyEvent)
+        and event.subCode == xcffib.randr.Notify.OutputChange
+    )
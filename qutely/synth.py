@@ -0,0 +1,87 @@
+"""Synthetic key events through the XTEST extension on qtile's X connection.
+
+A ``Synth`` can be used as an action in a KeyList, e.g. ``Synth("Menu")`` or
+``Synth("ctrl+shift+t", "Return")`` for a short sequence. Key names are the
+ones of xdotool (X keysym names, case insensitive) joined with "+" for chords.
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any
+
+import xcffib
+import xcffib.xtest
+
+from libqtile.log_utils import logger
+from qutely.xconn import get_extension
+
+XTEST_VERSION = (2, 2)
+KEY_PRESS = 2
+KEY_RELEASE = 3
+
+MODIFIER_ALIASES = {
+    "ctrl": "control_l",
+    "control": "control_l",
+    "shift": "shift_l",
+    "alt": "alt_l",
+    "super": "super_l",
+    "meta": "meta_l",
+}
+
+Chord = tuple[int, ...]
+
+
+@lru_cache(maxsize=None)
+def keysym_from_name(name: str) -> int:
+    from libqtile.backend.x11.xkeysyms import keysyms
+
+    name = name.lower()
+    keysym = keysyms.get(MODIFIER_ALIASES.get(name, name))
+    if not keysym:
+        raise ValueError(f"unknown key name: {name}")
+    return keysym
+
+
+def parse_chord(spec: str) -> Chord:
+    return tuple(keysym_from_name(name) for name in spec.split("+"))
+
+
+class Synth:
+    """Type the given keys or chords in order."""
+
+    def __init__(self, *keys: str) -> None:
+        if not keys:
+            raise ValueError("no keys to send")
+        self.keys = keys
+        self.chords = [parse_chord(k) for k in keys]
+
+    def __repr__(self) -> str:
+        return f"Synth({', '.join(map(repr, self.keys))})"
+
+    def run(self, qtile: Any) -> None:
+        send_chords(qtile, self.chords)
+
+
+def send_chords(qtile: Any, chords: list[Chord]) -> None:
+    conn = qtile.core.conn
+    xtest = get_extension(conn.conn, xcffib.xtest, *XTEST_VERSION)
+
+    def fake(event_type: int, keycode: int) -> None:
+        # the time is a delay in milliseconds, not a timestamp
+        xtest.FakeInput(event_type, keycode, 0, xcffib.XCB_NONE, 0, 0, 0)
+
+    for chord in chords:
+        # qtile keeps the keysym to keycode table up to date on MappingNotify
+        keycodes = [conn.keysym_to_keycode(keysym)[0] for keysym in chord]
+        if not all(keycodes):
+            logger.warning(f"no keycode for keysyms {chord} in the current keymap")
+            continue
+        for keycode in keycodes:
+            fake(KEY_PRESS, keycode)
+        for keycode in reversed(keycodes):
+            fake(KEY_RELEASE, keycode)
+    conn.flush()
+
+
+def send_keys(qtile: Any, *keys: str) -> None:
+    send_chords(qtile, [parse_chord(k) for k in keys])
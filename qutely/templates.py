@@ -1,24 +1,310 @@
+from __future__ import annotations
+
 import os
 import re
-import yaml
+import json
+import stat
+import asyncio
 import hashlib
+import tempfile
+import functools
+import threading
 from pathlib import Path
-from jinja2 import Environment, FileSystemLoader
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
 
 from libqtile.log_utils import logger
 from qutely.vars import get_config
 
 cur_dir = Path(__file__).absolute().parent
+TEMPLATES_DIR = cur_dir / "templates"
+BYTECODE_CACHE_DIR = Path("~/.cache/qtile/jinja").expanduser()
+MANIFEST_FILE = Path("~/.cache/qtile/templates.json").expanduser()
 
+_environment: Any = None
+# template name -> (hash of its sources, the templates it consists of, names of
+# the variables it reads or None if they cannot be determined statically)
+_inputs: dict[str, tuple[str, list[str], Optional[frozenset[str]]]] = {}
+# destination -> digest of the inputs of its last render and the stat of the written file
+_manifest: Optional[dict[str, dict[str, Any]]] = None
+_manifest_lock = threading.Lock()
 
-def get_template(file):
-    templates_dir = cur_dir / "templates"
-    loader = FileSystemLoader(templates_dir)
-    return Environment(loader=loader, line_comment_prefix="#j2:", enable_async=True).get_template(
-        file
+
+class TemplateSpec(NamedTuple):
+    src: str
+    dest: str
+    keep_empty: bool = True
+    keep_comments: bool = True
+    comment_start: str = "#"
+    keep_modelines: bool = True
+
+
+DUNSTRC = TemplateSpec("dunstrc", "~/.config/dunst", keep_empty=False, keep_comments=False)
+COMPTON_CONF = TemplateSpec("compton.conf", "~/.config")
+PICOM_CONF = TemplateSpec("picom.conf", "~/.config")
+KITTY_CONF = TemplateSpec("kitty.conf", "~/.config/kitty")
+TERMINALRC = TemplateSpec("terminalrc", "~/.config/xfce4/terminal")
+ALL_TEMPLATES = [DUNSTRC, KITTY_CONF, PICOM_CONF, COMPTON_CONF, TERMINALRC]
+
+
+def make_environment(bytecode_cache: bool = True) -> Any:
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+    cache = None
+    if bytecode_cache:
+        BYTECODE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache = FileSystemBytecodeCache(str(BYTECODE_CACHE_DIR))
+    return Environment(
+        loader=FileSystemLoader(TEMPLATES_DIR),
+        line_comment_prefix="#j2:",
+        bytecode_cache=cache,
+        auto_reload=True,
     )
 
 
+def get_environment() -> Any:
+    global _environment
+    if _environment is None:
+        _environment = make_environment()
+    return _environment
+
+
+def get_template(file):
+    return get_environment().get_template(file)
+
+
+def _collect_inputs(env: Any, name: str, seen: list[str]) -> Optional[set[str]]:
+    from jinja2 import meta
+
+    seen.append(name)
+    source, _, _ = env.loader.get_source(env, name)
+    ast = env.parse(source)
+    names: Optional[set[str]] = set(meta.find_undeclared_variables(ast))
+    for ref in meta.find_referenced_templates(ast):
+        if ref is None:
+            # dynamic include, any variable could be used
+            names = None
+            continue
+        if ref in seen:
+            continue
+        ref_names = _collect_inputs(env, ref, seen)
+        names = None if names is None or ref_names is None else names | ref_names
+    return names
+
+
+def _sources_hash(env: Any, names: list[str]) -> str:
+    h = hashlib.md5()
+    for name in names:
+        source, _, _ = env.loader.get_source(env, name)
+        h.update(source.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def template_inputs(src: str) -> tuple[str, Optional[frozenset[str]]]:
+    """Return the hash of the sources of ``src`` and the variables it depends on.
+
+    The variables are only analyzed again when one of the sources changed.
+    """
+    env = get_environment()
+    cached = _inputs.get(src)
+    if cached is not None:
+        sources_hash, templates, names = cached
+        if _sources_hash(env, templates) == sources_hash:
+            return sources_hash, names
+    templates = []
+    found = _collect_inputs(env, src, templates)
+    names = None if found is None else frozenset(found)
+    sources_hash = _sources_hash(env, templates)
+    _inputs[src] = (sources_hash, templates, names)
+    return sources_hash, names
+
+
+def input_digest(src: str, src_vars: dict[str, Any], options: tuple[Any, ...]) -> str:
+    source_hash, names = template_inputs(src)
+    used = src_vars if names is None else {k: v for k, v in src_vars.items() if k in names}
+    payload = json.dumps([source_hash, used, options], sort_keys=True, default=repr)
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def _load_manifest() -> dict[str, dict[str, Any]]:
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST_FILE) as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def _stat_key(path: str) -> Optional[list[int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def is_up_to_date(dest: str, digest: str) -> bool:
+    with _manifest_lock:
+        entry = _load_manifest().get(dest)
+    # files that were edited or removed by hand are rendered again
+    return entry is not None and entry["digest"] == digest and entry["stat"] == _stat_key(dest)
+
+
+def _remember(dest: str, digest: str) -> None:
+    with _manifest_lock:
+        manifest = _load_manifest()
+        manifest[dest] = {"digest": digest, "stat": _stat_key(dest)}
+        MANIFEST_FILE.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(str(MANIFEST_FILE), json.dumps(manifest, indent=2).encode())
+
+
+def forget(dest: Optional[str] = None) -> None:
+    """Drop the manifest entry of ``dest`` (or all entries), forcing a render."""
+    with _manifest_lock:
+        manifest = _load_manifest()
+        if dest is None:
+            manifest.clear()
+        else:
+            manifest.pop(os.path.abspath(os.path.expanduser(dest)), None)
+
+
+class AtomicFile:
+    """A temporary file next to ``dest`` that replaces it on commit."""
+
+    def __init__(self, dest: str) -> None:
+        self.dest = dest
+        try:
+            self.mode = stat.S_IMODE(os.stat(dest).st_mode)
+        except FileNotFoundError:
+            self.mode = 0o644
+        fd, self.tmp = tempfile.mkstemp(
+            dir=os.path.dirname(dest), prefix=f".{os.path.basename(dest)}."
+        )
+        self.file = os.fdopen(fd, "wb")
+        self.done = False
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+
+    def commit(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.chmod(self.tmp, self.mode)
+        os.replace(self.tmp, self.dest)
+        self.done = True
+
+    def discard(self) -> None:
+        self.file.close()
+        os.unlink(self.tmp)
+        self.done = True
+
+    def __enter__(self) -> AtomicFile:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if not self.done:
+            self.discard()
+
+
+def atomic_write(dest: str, content: bytes) -> None:
+    with AtomicFile(dest) as f:
+        f.write(content)
+        f.commit()
+
+
+def file_md5(path: str) -> Optional[str]:
+    h = hashlib.md5()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 16):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def line_filter(
+    keep_empty: bool, keep_comments: bool, comment_start: str, keep_modelines: bool
+) -> Optional[Callable[[str], bool]]:
+    """Return a predicate deciding which lines to keep, or None to keep all of them."""
+    if keep_empty and keep_comments:
+        return None
+    modeline = re.compile(r"\s*{} vim:".format(re.escape(comment_start)))
+    comment = re.compile(r"\s*{}".format(re.escape(comment_start)))
+
+    def keep(line: str) -> bool:
+        if not line.strip():
+            return keep_empty
+        if modeline.match(line):
+            return keep_modelines
+        if comment.match(line):
+            return keep_comments
+        return True
+
+    return keep
+
+
+def iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    rest = ""
+    for chunk in chunks:
+        *lines, rest = (rest + chunk).split("\n")
+        yield from lines
+    yield rest
+
+
+def filter_output(chunks: Iterable[str], keep: Optional[Callable[[str], bool]]) -> Iterator[str]:
+    if keep is None:
+        yield from chunks
+        return
+    sep = ""
+    for line in iter_lines(chunks):
+        if keep(line):
+            yield sep + line
+            sep = "\n"
+
+
+def _render_sync(
+    src: str,
+    dest: str,
+    src_vars: dict[str, Any],
+    keep_empty: bool,
+    keep_comments: bool,
+    comment_start: str,
+    keep_modelines: bool,
+) -> bool:
+    options = (keep_empty, keep_comments, comment_start, keep_modelines)
+    digest = input_digest(src, src_vars, options)
+    if is_up_to_date(dest, digest):
+        return False
+
+    keep = line_filter(*options)
+    new_hash = hashlib.md5()
+    # the output is streamed through the filter into a temporary file, which only
+    # replaces the destination if the content differs
+    with AtomicFile(dest) as f:
+        for piece in filter_output(get_template(src).generate(**src_vars), keep):
+            data = piece.encode()
+            new_hash.update(data)
+            f.write(data)
+        has_changed = file_md5(dest) != new_hash.hexdigest()
+        if has_changed:
+            f.commit()
+    _remember(dest, digest)
+    return has_changed
+
+
+def resolve(src: str, dest: str) -> tuple[str, str]:
+    dest = os.path.abspath(os.path.expanduser(dest))
+    src = src if src.endswith(".j2") else f"{src}.j2"
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, src.replace(".j2", ""))
+    return src, dest
+
+
 async def render(
     src,
     dest,
@@ -27,49 +313,36 @@ async def render(
     comment_start="#",
     keep_modelines=True,
     overrides=None,
+    variables: Optional[dict[str, Any]] = None,
 ) -> bool:
-    dest = os.path.abspath(os.path.expanduser(dest))
-    src = src if src.endswith(".j2") else f"{src}.j2"
-    if os.path.isdir(dest):
-        dest = os.path.join(dest, src.replace(".j2", ""))
-    if os.path.exists(dest):
-        with open(dest, "rb") as f:
-            old_hash = hashlib.md5(f.read()).hexdigest()
-    else:
-        old_hash = None
-    t = get_template(src)
-
-    src_vars = get_config(src)
-
-    _content = await t.render_async(**src_vars)
-    if keep_comments and keep_empty:
-        content = _content
-    else:
-        lines = []
-        for line in _content.split("\n"):
-            if not line.strip():
-                if keep_empty:
-                    lines.append(line)
-                else:
-                    continue
-            elif re.match(r"^\s*{} vim:".format(comment_start), line):
-                if keep_modelines:
-                    lines.append(line)
-                else:
-                    continue
-            elif re.match(r"^\s*{}".format(comment_start), line):
-                if keep_comments:
-                    lines.append(line)
-                else:
-                    continue
-            else:
-                lines.append(line)
-        content = "\n".join(lines)
-
-    new_hash = hashlib.md5(content.encode()).hexdigest()
-    if not old_hash == new_hash:
-        with open(dest, "w") as f:
-            f.write(content)
-        return True
-    else:
-        return False
+    src, dest = resolve(src, dest)
+    # the variables depend on the screen layout and thus on the x connection, which
+    # must only be used from the event loop. rendering itself happens in a worker thread
+    src_vars = get_config(src) if variables is None else variables
+    if overrides:
+        src_vars = src_vars | overrides
+    return await asyncio.to_thread(
+        _render_sync,
+        src,
+        dest,
+        src_vars,
+        keep_empty,
+        keep_comments,
+        comment_start,
+        keep_modelines,
+    )
+
+
+async def render_many(*specs: TemplateSpec) -> dict[str, bool]:
+    results = await asyncio.gather(
+        *(render(*spec) for spec in specs),
+        return_exceptions=True,
+    )
+    changed = {}
+    for spec, res in zip(specs, results):
+        if isinstance(res, BaseException):
+            logger.error(f"could not render template {spec.src}: {res}", exc_info=res)
+            changed[spec.src] = False
+        else:
+            changed[spec.src] = res
+    return changed
@@ -6,14 +6,14 @@ import re
 import math
 from enum import Enum
 from qutely import procs, templates
+from qutely.templates import COMPTON_CONF, DUNSTRC, KITTY_CONF, PICOM_CONF, TERMINALRC
+from qutely.pipeline import Pipeline, PipelineReport
+from qutely.profiling import subscribe
+from qutely import window_rules
 import asyncio
 from asyncio.subprocess import create_subprocess_exec as new_proc
-import aiofiles
-import subprocess
-import psutil
-from itertools import chain
 from pathlib import Path
-from typing import Iterable, TypedDict, Any, cast, Awaitable, TYPE_CHECKING
+from typing import Iterable, TypedDict, Any, cast, Awaitable, Callable, TYPE_CHECKING
 from libqtile import hook
 from libqtile.core.manager import Qtile
 from libqtile.backend.x11.window import Window, XWindow
@@ -49,7 +49,7 @@ class TerminalSupportStatus(Enum):
 
 
 def on_reload(f: Any) -> Any:
-    return hook.subscribe.user("custom_reload", f)
+    return subscribe.user("custom_reload")(f)
 
 
 # vim: 0xe7c5 or 0xe62b
@@ -420,29 +420,27 @@ async def reload_nvim_colors(is_light_theme: bool) -> None:
     await asyncio.gather(*tasks)
 
 
+async def render_configs(*specs: templates.TemplateSpec) -> dict[str, bool]:
+    changed = await templates.render_many(*specs)
+    if changed.get(KITTY_CONF.src):
+        from libqtile import qtile
+
+        qtile.call_soon(reload_kitty_config)
+    return changed
+
+
 async def render_dunstrc() -> bool:
-    return await templates.render(
-        "dunstrc",
-        "~/.config/dunst",
-        keep_comments=False,
-        keep_empty=False,
-    )
+    return (await render_configs(DUNSTRC))[DUNSTRC.src]
 
 
 async def render_compton_config() -> bool:
-    return await templates.render(
-        "compton.conf",
-        "~/.config",
-        keep_empty=True,
-    )
+    return (await render_configs(COMPTON_CONF))[COMPTON_CONF.src]
 
 
 async def render_picom_config() -> bool:
-    return await templates.render(
-        "picom.conf",
-        "~/.config",
-        keep_empty=True,
-    )
+    from qutely.opacity import picom_variables
+
+    return await templates.render(*PICOM_CONF, overrides=picom_variables())
 
 
 async def increase_kitty_font_size(*_) -> None:
@@ -458,27 +456,13 @@ async def render_kitty_config(font_size_inc: int = 0) -> bool:
         current_size = get_kitty_font_size()
         new_size = current_size + font_size_inc
         if not new_size:
-            return
+            return False
         set_kitty_font_size(new_size)
-    has_changed = await templates.render(
-        "kitty.conf",
-        "~/.config/kitty",
-        keep_empty=True,
-        comment_start="#",
-    )
-    if has_changed:
-        from libqtile import qtile
-
-        qtile.call_soon(reload_kitty_config)
-    return has_changed
+    return (await render_configs(KITTY_CONF))[KITTY_CONF.src]
 
 
 async def render_terminalrc() -> bool:
-    return await templates.render(
-        "terminalrc",
-        "~/.config/xfce4/terminal",
-        keep_empty=True,
-    )
+    return (await render_configs(TERMINALRC))[TERMINALRC.src]
 
 
 def restart_qtile(qtile: Qtile) -> None:
@@ -502,8 +486,7 @@ def stop_distraction_free_mode(qtile: Qtile) -> None:
     procs._dunstify("including distractions again")
 
 
-async def reload_qtile(qtile: Qtile, light_theme: bool = False) -> None:
-    logger.warn("reloading config (async)")
+async def _export_zsh_path() -> None:
     path_file = os.path.join("/home", "lars", ".config", "zsh", "path")
     tmp_file = "/tmp/zsh-export-path"
     await procs.Proc(
@@ -511,29 +494,80 @@ async def reload_qtile(qtile: Qtile, light_theme: bool = False) -> None:
         shell=True,
         env={"QTILE_EXPORT_PATH": tmp_file},
     ).run()
-    logger.warn("zsh path_file sourced")
     with open(tmp_file, "r") as f:
         path_env = f.read()
     if path_env.strip():
         os.environ["PATH"] = path_env.strip()
-    os.environ[THEME_BG_KEY] = "1" if light_theme else ""
-    logger.warn("triggering qtile reload")
-    qtile.reload_config()
-    logger.warn("qtile.reload_config() done")
-    hook.fire("user_custom_reload")
-    qtile.call_soon(setup_all_group_icons)
-    logger.warn("finished reloading config (async)")
-    procs.Proc.await_many(
-        render_kitty_config(),
-        reload_nvim_colors(light_theme),
-        procs.start_custom_session,
-        procs.resume_dunst,
-    )
 
 
-@hook.subscribe.screens_reconfigured
+def _proc_phase(proc: procs.Proc) -> Callable[[], Awaitable[None]]:
+    """Run a clone of ``proc``, failing the phase on a non-zero rc. Proc.run does not raise."""
+
+    async def run() -> None:
+        p = proc.clone()
+        await p.run()
+        if p.returncode != 0:
+            raise RuntimeError(f"command '{p.cmd}' did not succeed, rc={p.returncode}")
+
+    return run
+
+
+def get_reload_pipeline(qtile: Qtile, light_theme: bool = False) -> Pipeline:
+    pipeline = Pipeline("reload")
+
+    @pipeline.phase("path")
+    async def export_path() -> None:
+        await _export_zsh_path()
+
+    @pipeline.phase("theme")
+    def set_theme() -> None:
+        os.environ[THEME_BG_KEY] = "1" if light_theme else ""
+
+    @pipeline.phase("reload_config", "path", "theme")
+    def reload_config() -> None:
+        qtile.reload_config()
+
+    @pipeline.phase("custom_reload", "reload_config")
+    def fire_custom_reload() -> None:
+        hook.fire("user_custom_reload")
+
+    @pipeline.phase("group_icons", "reload_config")
+    def group_icons() -> None:
+        # deferred like before the pipeline, so it runs after qtile has finished the reload
+        qtile.call_soon(setup_all_group_icons)
+
+    @pipeline.phase("templates", "reload_config")
+    async def render_templates() -> None:
+        from qutely.opacity import picom_dimming_enabled
+
+        await render_configs(DUNSTRC, KITTY_CONF)
+        if picom_dimming_enabled():
+            await render_picom_config()
+
+    @pipeline.phase("nvim")
+    async def nvim_colors() -> None:
+        await reload_nvim_colors(light_theme)
+
+    pipeline.phase("session", "path")(_proc_phase(procs.start_custom_session))
+    pipeline.phase("dunst")(_proc_phase(procs.resume_dunst))
+    return pipeline
+
+
+last_reload_report: PipelineReport | None = None
+
+
+async def reload_qtile(qtile: Qtile, light_theme: bool = False) -> None:
+    global last_reload_report
+    logger.info("reloading config (async)")
+    last_reload_report = await get_reload_pipeline(qtile, light_theme).run()
+    if failed := last_reload_report.failed:
+        names = ", ".join(f"{r.name} ({r.state})" for r in failed)
+        await procs.Proc.default_dunstifier.error(f"reload phases did not succeed: {names}")
+
+
+@subscribe.screens_reconfigured
 async def screens_reconfigured() -> None:
-    await render_kitty_config()
+    await render_configs(DUNSTRC, KITTY_CONF)
     await procs.resume_dunst.run()
 
 
@@ -547,6 +581,8 @@ async def suspend(qtile: Qtile) -> None:
 
 
 def reload_kitty_config() -> None:
+    import psutil
+
     for p in psutil.process_iter():
         if p.name() == "kitty":
             p.send_signal(psutil.signal.SIGUSR1)
@@ -595,8 +631,8 @@ def get_sticky_index_and_group(window: Window) -> tuple[int, _Group, bool] | Non
 
 
 def set_group_label_from_window_class(window: Window) -> None:
-    ch: int | None = None
-    if window.name:
+    ch: int | None = getattr(window, "_rule_label", None)
+    if not ch and window.name:
         name = window.name.split(" ")[0].lower().replace(":", "")
         ch = group_labels["name"].get(name)
 
@@ -660,6 +696,8 @@ class KbdBacklight:
         self.max_value = 0
 
     async def configure(self) -> None:
+        import aiofiles
+
         async with aiofiles.open(self.dev / "max_brightness", "r") as f:
             self.max_value = int(await f.read())
         async with aiofiles.open(self.dev / "brightness", "r") as f:
@@ -671,6 +709,8 @@ class KbdBacklight:
             # raise ValueError(
             #     "KbdBacklight has not been initialized. Please run configure() first"
             # )
+        import aiofiles
+
         value = (self.value + 1) % (self.max_value + 1)
         async with aiofiles.open(self.dev / "brightness", "w") as f:
             await f.write(str(value))
@@ -711,8 +751,11 @@ async def spawn_terminal() -> None:
         await new_proc("kitty", f"--class={TERM_SUPPLY_CLASS}", close_fds=True)
 
 
-@hook.subscribe.client_new
-def send_kitty_to_empty_group(window: Window) -> None:
+@window_rules.stage("route")
+def send_kitty_to_empty_group(window: Window, group: str | None = None) -> None:
+    if group is not None:
+        window.togroup(group)
+        return
     if (
         window.get_wm_class()[1] == TERM_SUPPLY_CLASS
         and get_term_supply_status(window) is TerminalSupportStatus.NOT_INITIALIZED
@@ -721,7 +764,7 @@ def send_kitty_to_empty_group(window: Window) -> None:
         window.togroup(TERM_GROUP)
 
 
-@hook.subscribe.group_window_add
+@subscribe.group_window_add
 async def add_more_terminals(group: Group, window: Window) -> None:
     if (
         group.name != TERM_GROUP and window.get_wm_class()[1] == TERM_SUPPLY_CLASS
@@ -730,7 +773,7 @@ async def add_more_terminals(group: Group, window: Window) -> None:
         await spawn_terminal()
 
 
-@hook.subscribe.addgroup
+@subscribe.addgroup
 def hide_empty_group(name: str) -> None:
     if not name:
         from libqtile import qtile
@@ -738,14 +781,30 @@ def hide_empty_group(name: str) -> None:
         qtile.groups_map[""].set_screen(None)
 
 
-@hook.subscribe.user("custom_reload")
+@subscribe.user("custom_reload")
 async def init_more_widgets() -> None:
     await kbd_backlight.configure()
 
 
-@hook.subscribe.client_new
-def bring_floating_to_screen(window: Window) -> None:
-    if not window or not window.window or not window.floating:
+@window_rules.stage("label")
+def set_rule_label(window: Window, label: int | None = None) -> None:
+    window._rule_label = label
+
+
+@window_rules.stage("place")
+def bring_floating_to_screen(window: Window, place: str | None = None) -> None:
+    if not window or not window.window:
+        return
+    if place == "center":
+        window.center()
+        return
+    if place == "current-screen":
+        from libqtile import qtile
+
+        window.togroup(qtile.current_group.name)
+        window.toscreen(qtile.current_screen.index)
+        return
+    if not window.floating:
         return
     if (cls := window.get_wm_class()[1]) not in onscreen_floaters:
         return
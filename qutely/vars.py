@@ -1,12 +1,14 @@
 from __future__ import annotations
 
-from typing import Any
+import copy
+from typing import Any, Optional
 from qutely.display import (
     is_only_laptop,
     is_light_theme,
-    num_screens,
-    res,
+    get_screens,
+    get_resolutions,
     get_wal_colors,
+    screen_generation,
 )
 from qutely.debug import in_debug_mode
 
@@ -15,7 +17,7 @@ laptop_screen = "eDP-1"
 _config = {
     "dunstrc": {
         "font": "Hack Nerd Font",
-        "fontsize": 9 if is_only_laptop(laptop_screen) else 11,
+        "fontsize": 11,
         "icon_path": "/usr/share/icons/HighContrast/16x16",
         "width": [120, 250],
         "height": 400,
@@ -62,12 +64,27 @@ _config = {
     },
     "terminalrc": {"bg": "#0d0d00"},
     "kitty.conf": {
-        "font": {"family": "Hack Nerd Font", "size": 9 if is_only_laptop(laptop_screen) else 8}
+        "font": {"family": "Hack Nerd Font", "size": 8}
     },
     "drop_down_classes": ["signal", "telegram", "ding"],
 }
 
+_config["compositor"]["drop_down_classes"] = _config["drop_down_classes"]
 _config["compton.conf"] = _config["picom.conf"] = _config["compositor"]
+_config_generation = -1
+
+
+def update_screen_dependent_config() -> None:
+    global _config_generation
+    if _config_generation == screen_generation():
+        return
+    _config_generation = screen_generation()
+    apply_screen_dependent_config(_config, is_only_laptop(laptop_screen))
+
+
+def apply_screen_dependent_config(config: dict[str, Any], only_laptop: bool) -> None:
+    config["dunstrc"]["fontsize"] = 9 if only_laptop else 11
+    config["kitty.conf"]["font"]["size"] = 9 if only_laptop else 8
 
 
 def get_light_colors() -> dict[str, str | list[str]]:
@@ -95,26 +112,57 @@ def get_light_colors() -> dict[str, str | list[str]]:
     }
 
 
-def get_defaults() -> dict[str, Any]:
-    default_vars = {
+def make_defaults(
+    num_screens: int,
+    res: list[dict[str, int]],
+    light_theme: bool,
+    wal_colors: Optional[dict[str, Any]],
+    debug: bool = in_debug_mode,
+) -> dict[str, Any]:
+    return {
         "defaults": {
             "num_screens": num_screens,
             "res": res,
-            "in_debug_mode": in_debug_mode,
+            "in_debug_mode": debug,
         },
-        "wal": get_light_colors() if is_light_theme else get_wal_colors(),
+        "wal": get_light_colors() if light_theme else wal_colors,
     }
-    return default_vars
+
+
+def get_defaults() -> dict[str, Any]:
+    return make_defaults(
+        get_screens().num_screens,
+        get_resolutions(),
+        is_light_theme,
+        None if is_light_theme else get_wal_colors(),
+    )
 
 
 def get_config(key: str) -> dict[str, Any]:
+    update_screen_dependent_config()
     sub_config = _config[key.replace(".j2", "")]
     return sub_config | get_defaults()
 
 
 def get_kitty_font_size() -> int:
+    update_screen_dependent_config()
     return _config["kitty.conf"]["font"]["size"]
 
 
 def set_kitty_font_size(size: int) -> None:
+    update_screen_dependent_config()
     _config["kitty.conf"]["font"]["size"] = size
+
+
+def get_fixture_config(
+    key: str,
+    res: list[dict[str, int]],
+    light_theme: bool,
+    wal_colors: Optional[dict[str, Any]],
+    only_laptop: bool,
+) -> dict[str, Any]:
+    """Like get_config, but for the given screens and theme instead of the live ones."""
+    config = copy.deepcopy(_config)
+    apply_screen_dependent_config(config, only_laptop)
+    defaults = make_defaults(len(res), res, light_theme, wal_colors, debug=False)
+    return config[key.replace(".j2", "")] | defaults
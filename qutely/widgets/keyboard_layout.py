@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from libqtile import widget
+from libqtile.widget.base import InLoopPollText
+from libqtile.widget.keyboardlayout import _BaseLayoutBackend
+
+from qutely import input as input_config
+
+
+class XkbLayoutBackend(_BaseLayoutBackend):
+    """Read and switch the keymap in-process instead of calling setxkbmap."""
+
+    def __init__(self, qtile: Any = None) -> None:
+        pass
+
+    def get_keyboard(self) -> str:
+        keymap = input_config.get_rules_names()
+        return str(keymap) if keymap is not None else "unknown"
+
+    def set_keyboard(self, layout: str, options: Optional[str]) -> None:
+        input_config.config.set_keymap(input_config.Keymap.parse(layout, options))
+
+
+class KeyboardLayout(widget.KeyboardLayout):
+    def _configure(self, qtile: Any, bar: Any) -> None:
+        if qtile.core.name != "x11":
+            super()._configure(qtile, bar)
+            return
+        InLoopPollText._configure(self, qtile, bar)
+        self.backend = XkbLayoutBackend(qtile)
+        # the configured keymap is loaded by qutely.input on startup
@@ -0,0 +1,52 @@
+from typing import Any
+
+from libqtile.command.base import expose_command
+from libqtile.widget.base import InLoopPollText, ORIENTATION_HORIZONTAL
+
+from qutely.profiling import hook_stats, key_stats
+
+
+class ProfilerWidget(InLoopPollText):
+    """Show the hook handler with the worst p99 latency and expose the collected stats."""
+
+    orientations = ORIENTATION_HORIZONTAL
+    defaults = [
+        ("update_interval", 5, "number of seconds between updates"),
+        ("warn_ms", 10, "p99 latency in milliseconds above which the handler is displayed"),
+        ("format", "⏱ {name} {p99_ms:.1f}ms", "format of the displayed text"),
+    ]
+
+    def __init__(self, **config: Any) -> None:
+        super().__init__("", **config)
+        self.add_defaults(ProfilerWidget.defaults)
+
+    def poll(self) -> str:
+        worst = hook_stats.report(top=1, with_stacks=False)
+        if not worst or worst[0]["p99_ms"] < self.warn_ms:
+            return ""
+        entry = worst[0] | {"name": worst[0]["name"].split(".")[-1]}
+        return self.format.format(**entry)
+
+    @expose_command()
+    def hook_stats(self, top: int = 10, sort: str = "p99_ms", stacks: bool = False) -> list[dict[str, Any]]:
+        return hook_stats.report(top=top, sort=sort, with_stacks=stacks)
+
+    @expose_command()
+    def dump_hook_stats(self) -> str:
+        return str(hook_stats.dump())
+
+    @expose_command()
+    def reset_hook_stats(self) -> None:
+        hook_stats.reset()
+
+    @expose_command()
+    def key_stats(self, top: int = 10, sort: str = "p99_ms") -> list[dict[str, Any]]:
+        return key_stats.report(top=top, sort=sort, with_stacks=False)
+
+    @expose_command()
+    def dump_key_stats(self) -> str:
+        return str(key_stats.dump())
+
+    @expose_command()
+    def reset_key_stats(self) -> None:
+        key_stats.reset()
@@ -0,0 +1,32 @@
+from qutely import color
+
+COLORS = ("005000", "909000", "f08080")
+DEC_COLORS = tuple(color.hex_to_dec(c) for c in COLORS)
+
+
+def test_endpoints_and_clamping():
+    gradient = color.Gradient(COLORS, 100)
+    assert gradient(0) == gradient(-5) == color.gradient(0, 100, DEC_COLORS)
+    assert gradient(100) == gradient(1000) == color.gradient(100, 100, DEC_COLORS)
+
+
+def test_lookup_matches_gradient_on_the_grid():
+    gradient = color.Gradient(COLORS, 255, scaling=1.2)
+    for value in range(256):
+        assert gradient(value) == color.gradient(value, 255, DEC_COLORS, scaling=1.2)
+
+
+def test_lookup_rounds_to_the_nearest_entry():
+    gradient = color.Gradient(COLORS, 255)
+    assert gradient(41.4) == gradient(41)
+    assert gradient(41.6) == gradient(42)
+
+
+def test_map_matches_single_lookups():
+    gradient = color.Gradient(COLORS, 100)
+    values = [-10, 0, 0.2, 12.5, 49.9, 50, 99.8, 100, 150]
+    assert gradient.map(values) == [gradient(v) for v in values]
+
+
+def test_decimal_colors_are_accepted():
+    assert color.Gradient(DEC_COLORS, 100).lut == color.Gradient(COLORS, 100).lut
@@ -0,0 +1,97 @@
+import asyncio
+
+from qutely.audio import AudioController, AudioState, FakeBackend
+
+
+def make_controller(state=AudioState(0.5, False, 0.5, False)):
+    backend = FakeBackend(state)
+    audio = AudioController(backend, step=0.05)
+    updates = []
+    audio.subscribe(updates.append)
+    return audio, backend, updates
+
+
+def test_start_pushes_initial_state():
+    async def run():
+        audio, backend, updates = make_controller()
+        await audio.start()
+        assert backend.connected
+        assert updates == [AudioState(0.5, False, 0.5, False)]
+        await audio.stop()
+        assert not backend.connected
+
+    asyncio.run(run())
+
+
+def test_volume_changes_are_pushed_without_waiting_for_events():
+    async def run():
+        audio, backend, updates = make_controller()
+        await audio.volume_up()
+        assert updates[-1].volume == 0.55
+        await audio.volume_down()
+        await audio.volume_down()
+        assert updates[-1].volume == 0.45
+        await audio.stop()
+
+    asyncio.run(run())
+
+
+def test_volume_is_clamped():
+    async def run():
+        audio, backend, updates = make_controller(AudioState(0.98, False, 0.02, False))
+        await audio.volume_up()
+        await audio.mic_down()
+        assert updates[-1] == AudioState(1.0, False, 0.0, False)
+        await audio.stop()
+
+    asyncio.run(run())
+
+
+def test_mute_and_mic():
+    async def run():
+        audio, backend, updates = make_controller()
+        await audio.toggle_mute()
+        assert updates[-1].muted
+        await audio.toggle_mic()
+        assert updates[-1].mic_muted
+        await audio.toggle_mute()
+        assert not updates[-1].muted
+        await audio.mute_all()
+        assert updates[-1] == AudioState(0.5, True, 0.5, True)
+        await audio.stop()
+
+    asyncio.run(run())
+
+
+def test_external_changes_are_pushed_from_events():
+    async def run():
+        audio, backend, updates = make_controller()
+        await audio.start()
+        backend.set_state(volume=0.8)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert updates[-1].volume == 0.8
+        # unchanged state is not pushed again
+        count = len(updates)
+        backend.set_state(volume=0.8)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert len(updates) == count
+        await audio.stop()
+
+    asyncio.run(run())
+
+
+def test_failing_listener_does_not_stop_others():
+    async def run():
+        audio, backend, updates = make_controller()
+
+        def fail(state):
+            raise RuntimeError("broken widget")
+
+        audio.listeners.insert(0, fail)
+        await audio.volume_up()
+        assert updates[-1].volume == 0.55
+        await audio.stop()
+
+    asyncio.run(run())
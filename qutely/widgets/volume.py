@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+from libqtile.command.base import expose_command
+from libqtile.widget.base import ORIENTATION_HORIZONTAL, _TextBox
+
+from qutely.audio import AudioController, AudioState, controller
+
+EMOJIS = ["\U0001f507", "\U0001f508", "\U0001f509", "\U0001f50a"]
+
+
+def volume_emoji(volume: float, muted: bool) -> str:
+    if muted or volume <= 0:
+        return EMOJIS[0]
+    if volume <= 0.3:
+        return EMOJIS[1]
+    if volume < 0.8:
+        return EMOJIS[2]
+    return EMOJIS[3]
+
+
+class VolumeWidget(_TextBox):
+    """Show the volume of the default sink, updated from the sound server's events."""
+
+    orientations = ORIENTATION_HORIZONTAL
+    defaults = [
+        ("format", "{emoji}", "format of the text, with {emoji}, {volume} (in %) and {mic}"),
+        ("mic_muted_text", "", "{mic} while the microphone is muted"),
+        ("volume_app", "pavucontrol", "application started on right click"),
+    ]
+
+    def __init__(self, audio: AudioController = controller, **config: Any) -> None:
+        super().__init__("", **config)
+        self.add_defaults(VolumeWidget.defaults)
+        self.audio = audio
+        self.add_callbacks(
+            {
+                "Button1": self.toggle_mute,
+                "Button3": self.open_volume_app,
+                "Button4": self.volume_up,
+                "Button5": self.volume_down,
+            }
+        )
+
+    def _configure(self, qtile: Any, bar: Any) -> None:
+        super()._configure(qtile, bar)
+        self.audio.subscribe(self.on_change)
+        # startup_complete does not fire again after a config reload
+        asyncio.create_task(self.audio.start())
+
+    def finalize(self) -> None:
+        self.audio.unsubscribe(self.on_change)
+        super().finalize()
+
+    def on_change(self, state: AudioState) -> None:
+        self.update(
+            self.format.format(
+                emoji=volume_emoji(state.volume, state.muted),
+                volume=round(state.volume * 100),
+                mic=self.mic_muted_text if state.mic_muted else "",
+            )
+        )
+
+    @expose_command()
+    def volume_up(self) -> None:
+        asyncio.create_task(self.audio.volume_up())
+
+    @expose_command()
+    def volume_down(self) -> None:
+        asyncio.create_task(self.audio.volume_down())
+
+    @expose_command()
+    def toggle_mute(self) -> None:
+        asyncio.create_task(self.audio.toggle_mute())
+
+    @expose_command()
+    def open_volume_app(self) -> None:
+        self.qtile.spawn(self.volume_app)
+
+    @expose_command()
+    def state(self) -> dict[str, Any]:
+        return self.audio.state._asdict() if self.audio.state else {}
@@ -0,0 +1,217 @@
+"""Per window class behavior from ~/.config/qtile/window-rules.toml.
+
+Every rule matches on any of ``class`` (instance or general class), ``name``,
+``role`` and ``type``. Values are compared case insensitively, values prefixed
+with "re:" are searched as regular expressions. All given properties must match.
+The actions of a rule are applied by the client_new stages of the same name::
+
+    [[rule]]
+    class = "arandr"
+    float = true
+    size = [600, 600]
+    place = "center"      # or "current-screen"
+
+    [[rule]]
+    class = "re:^jetbrains-"
+    opacity = 0.97        # or "full" to never dim the window
+    label = 0xE7B5
+    group = "c"
+
+For every stage, the first matching rule that sets it wins. Stages without a
+matching rule fall back to the built-in tables (floating_rules, opacity,
+util.group_labels). The file is reloaded when it changes, no config reload needed.
+"""
+from __future__ import annotations
+
+import os
+import re
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    import tomli as tomllib
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional
+
+from libqtile.backend.x11.window import Window
+from libqtile.log_utils import logger
+from qutely.profiling import subscribe
+
+RULES_FILE = Path("~/.config/qtile/window-rules.toml").expanduser()
+STAGES = ("float", "size", "place", "opacity", "label", "route")
+MATCH_KEYS = ("class", "name", "role", "type")
+PLACES = ("center", "current-screen")
+REGEX_PREFIX = "re:"
+
+Stage = Callable[[Window, Any], None]
+
+
+class WindowProps(NamedTuple):
+    cls0: Optional[str]
+    cls1: Optional[str]
+    name: Optional[str]
+    role: Optional[str]
+    type: Optional[str]
+
+    def get(self, key: str) -> tuple[Optional[str], ...]:
+        if key == "class":
+            return self.cls0, self.cls1
+        return (getattr(self, key),)
+
+
+def _lower(value: Optional[str]) -> Optional[str]:
+    return None if value is None else value.lower()
+
+
+def get_class_key(window: Window, refresh: bool = False) -> tuple[Optional[str], ...]:
+    """Return the lowercased (class, class, role, type) of ``window``.
+
+    Those do not change during the life of a window (in practice), so they are
+    only read from the x server once.
+    """
+    if not refresh and (key := getattr(window, "_class_key", None)) is not None:
+        return key
+    classes = window.window.get_wm_class()
+    cls0, cls1 = (None, None) if not classes else (_lower(classes[0]), _lower(classes[-1]))
+    key = (cls0, cls1, _lower(window.window.get_wm_window_role()), _lower(window.window.get_wm_type()))
+    window._class_key = key
+    return key
+
+
+def window_props(window: Window) -> WindowProps:
+    cls0, cls1, role, type = get_class_key(window)
+    return WindowProps(cls0, cls1, _lower(window.window.get_name()), role, type)
+
+
+def _compile_value(value: Any) -> Callable[[str], bool]:
+    if not isinstance(value, str):
+        raise ValueError(f"match values must be strings, not {value!r}")
+    if value.startswith(REGEX_PREFIX):
+        pattern = re.compile(value[len(REGEX_PREFIX):], re.I)
+        return lambda v: pattern.search(v) is not None
+    value = value.lower()
+    return lambda v: v == value
+
+
+def _check_action(stage: str, value: Any) -> Any:
+    if stage == "float" and not isinstance(value, bool):
+        raise ValueError(f"float must be true or false, not {value!r}")
+    if stage == "size" and not (
+        isinstance(value, list) and len(value) == 2 and all(isinstance(v, int) for v in value)
+    ):
+        raise ValueError(f"size must be [width, height], not {value!r}")
+    if stage == "place" and value not in PLACES:
+        raise ValueError(f"place must be one of {', '.join(PLACES)}, not {value!r}")
+    if stage == "opacity" and value != "full" and not (
+        isinstance(value, (int, float)) and 0 <= value <= 1
+    ):
+        raise ValueError(f"opacity must be between 0 and 1 or 'full', not {value!r}")
+    if stage == "label" and not isinstance(value, int):
+        raise ValueError(f"label must be a code point, not {value!r}")
+    if stage == "route" and not isinstance(value, str):
+        raise ValueError(f"group must be a group name, not {value!r}")
+    return value
+
+
+class Rule(NamedTuple):
+    conditions: list[tuple[str, Callable[[str], bool]]]
+    actions: dict[str, Any]
+
+    def matches(self, props: WindowProps) -> bool:
+        return all(
+            any(v is not None and predicate(v) for v in props.get(key))
+            for key, predicate in self.conditions
+        )
+
+
+def compile_rule(index: int, raw: dict[str, Any]) -> Rule:
+    conditions = [(key, _compile_value(raw[key])) for key in MATCH_KEYS if key in raw]
+    if not conditions:
+        raise ValueError(f"rule {index} does not match on any of {', '.join(MATCH_KEYS)}")
+    actions = {}
+    for key, value in raw.items():
+        if key in MATCH_KEYS:
+            continue
+        stage = "route" if key == "group" else key
+        if stage not in STAGES:
+            raise ValueError(f"rule {index} has unknown action {key!r}")
+        actions[stage] = _check_action(stage, value)
+    return Rule(conditions, actions)
+
+
+class WindowRules:
+    def __init__(self, rules: list[Rule], mtime: Optional[int] = None) -> None:
+        self.rules = rules
+        self.mtime = mtime
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> WindowRules:
+        path = path or RULES_FILE
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return cls([])
+        with path.open("rb") as f:
+            raw = tomllib.load(f)
+        rules = [compile_rule(i, r) for i, r in enumerate(raw.get("rule", []))]
+        return cls(rules, mtime)
+
+    def resolve(self, props: WindowProps) -> dict[str, Any]:
+        actions: dict[str, Any] = {}
+        for rule in self.rules:
+            if rule.matches(props):
+                actions = rule.actions | actions
+                if len(actions) == len(STAGES):
+                    break
+        return actions
+
+
+_rules: WindowRules = globals().get("_rules") or WindowRules([])
+# config reloads re-execute this module after modules it imports registered their stages again,
+# so the registry is kept. stages are keyed by module and qualified name, re-registering replaces them
+_stages: dict[str, dict[tuple[str, str], Stage]] = globals().get("_stages") or {name: {} for name in STAGES}
+
+
+def get_rules() -> WindowRules:
+    """Return the compiled rules, reloading the file if it changed."""
+    global _rules
+    try:
+        mtime: Optional[int] = os.stat(RULES_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime == _rules.mtime:
+        return _rules
+    try:
+        _rules = WindowRules.load()
+        logger.info(f"loaded {len(_rules.rules)} window rules from {RULES_FILE}")
+    except (OSError, ValueError, re.error) as e:
+        # keep the previous rules until the file is fixed
+        logger.error(f"invalid window rules in {RULES_FILE}: {e}")
+        _rules = WindowRules(_rules.rules, mtime)
+    return _rules
+
+
+def stage(name: str) -> Callable[[Stage], Stage]:
+    """Register ``func(window, value)`` for a stage of the client_new pipeline.
+
+    ``value`` is the action of the first matching rule or None if no rule sets it.
+    """
+    if name not in STAGES:
+        raise ValueError(f"unknown window rule stage: {name}")
+
+    def decorator(func: Stage) -> Stage:
+        _stages[name][func.__module__, func.__qualname__] = func
+        return func
+
+    return decorator
+
+
+@subscribe.client_new
+def apply_window_rules(window: Window) -> None:
+    rules = get_rules()
+    actions = rules.resolve(window_props(window)) if rules.rules else {}
+    for name in STAGES:
+        for func in list(_stages[name].values()):
+            try:
+                func(window, actions.get(name))
+            except Exception as e:
+                logger.error(f"window rule stage {name} ({func.__name__}) failed: {e}", exc_info=True)
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Callable, Optional
+
+import xcffib
+import xcffib.xproto
+from libqtile.log_utils import logger
+
+
+_private_conn: Optional[xcffib.Connection] = None
+_versioned_extensions: set[tuple[int, Any]] = set()
+
+
+def get_qtile_connection() -> Optional[xcffib.Connection]:
+    from libqtile import qtile
+
+    try:
+        return qtile.core.conn.conn
+    except AttributeError:
+        # not running inside qtile (yet), or not on the x11 backend
+        return None
+
+
+def get_private_connection() -> xcffib.Connection:
+    global _private_conn
+    if _private_conn is None or _private_conn.has_error():
+        _private_conn = xcffib.connect()
+    return _private_conn
+
+
+def get_connection() -> xcffib.Connection:
+    return get_qtile_connection() or get_private_connection()
+
+
+def get_root(conn: xcffib.Connection) -> int:
+    return conn.get_setup().roots[conn.pref_screen].root
+
+
+def get_extension(
+    conn: xcffib.Connection, module: Any, major: int, minor: int, version_request: str = "QueryVersion"
+) -> Any:
+    ext = conn(module.key)
+    # the server assumes protocol version 1.0 unless the client asks for more
+    if (id(conn), module) not in _versioned_extensions:
+        getattr(ext, version_request)(major, minor).reply()
+        _versioned_extensions.add((id(conn), module))
+    return ext
+
+
+def intern_atom(conn: xcffib.Connection, name: str, only_if_exists: bool = False) -> int:
+    return conn.core.InternAtom(only_if_exists, len(name), name).reply().atom
+
+
+def to_str(value: Any) -> str:
+    if hasattr(value, "to_string"):
+        return value.to_string()
+    return bytes(value).decode()
+
+
+def to_bytes(value: Any) -> bytes:
+    if hasattr(value, "buf"):
+        return bytes(value.buf())
+    return b"".join(v if isinstance(v, bytes) else bytes((v,)) for v in value)
+
+
+class EventWatcher:
+    """Dispatch the events of a dedicated X connection from the asyncio event loop.
+
+    qtile only handles the events it selected itself on its own connection, so
+    anything else (e.g. randr output changes, input hotplug) is watched here.
+    """
+
+    def __init__(
+        self,
+        select: Callable[[xcffib.Connection], None],
+        callback: Callable[[Any], None],
+    ) -> None:
+        self.select = select
+        self.callback = callback
+        self.conn: Optional[xcffib.Connection] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        if self.conn is not None:
+            return
+        self.conn = xcffib.connect()
+        self.select(self.conn)
+        self.conn.flush()
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.conn.get_file_descriptor(), self._on_readable)
+
+    def stop(self) -> None:
+        if self.conn is None:
+            return
+        if self.loop is not None:
+            self.loop.remove_reader(self.conn.get_file_descriptor())
+        self.conn.disconnect()
+        self.conn = None
+
+    def _on_readable(self) -> None:
+        assert self.conn is not None
+        try:
+            while event := self.conn.poll_for_event():
+                try:
+                    self.callback(event)
+                except Exception as e:
+                    logger.error(f"error while handling {event.__class__.__name__}: {e}", exc_info=True)
+        except xcffib.ConnectionException as e:
+            logger.error(f"lost x connection of event watcher: {e}")
+            self.stop()